@@ -0,0 +1,50 @@
+"""Benchmark bytes sent per post: remote originals vs the local image pipeline.
+
+Usage: python bench_images.py [image_url ...]
+"""
+import sys
+import time
+from images import prepare_image, record_sent, image_stats
+
+# Typical post images: Kitsu original posters and AniList extraLarge covers
+SAMPLE_URLS = [
+    "https://media.kitsu.app/anime/poster_images/7442/original.jpg",
+    "https://media.kitsu.app/anime/poster_images/1376/original.jpg",
+    "https://s4.anilist.co/file/anilistcdn/media/anime/cover/large/bx16498-73IhOXpJZiMF.jpg",
+    "https://s4.anilist.co/file/anilistcdn/media/anime/banner/16498-8jpFCOcDmneX.jpg",
+]
+
+def run_pass(urls):
+    """Prepare and account every url once; returns the prepared images that worked"""
+    prepared = []
+    for url in urls:
+        start = time.perf_counter()
+        image = prepare_image(url)
+        elapsed = (time.perf_counter() - start) * 1000
+        if image is None:
+            print(f"{'-':>12} {'-':>12} {'-':>7} {elapsed:>7.0f}  {url} (failed)")
+            continue
+        record_sent(image)
+        prepared.append(image)
+        saved = 100 - (image.size * 100 // image.original_size) if image.original_size else 0
+        print(f"{image.original_size:>12,} {image.size:>12,} {saved:>6}% {elapsed:>7.0f}  {url}")
+    return prepared
+
+def main(urls):
+    print(f"{'original':>12} {'sent':>12} {'saved':>7} {'ms':>7}  url")
+    prepared = run_pass(urls)
+    if prepared:
+        count = len(prepared)
+        total_original = sum(image.original_size for image in prepared)
+        total_sent = sum(image.size for image in prepared)
+        print(f"\nMean bytes per post: {total_original // count:,} original -> {total_sent // count:,} sent")
+
+    # Second pass runs on the cache the first one filled and should not download again
+    print("\nWarm cache:")
+    hits = image_stats["cache_hits"]
+    run_pass(urls)
+    print(f"\n{image_stats['cache_hits'] - hits}/{len(urls)} served from cache")
+    print(f"Cache stats: {image_stats}")
+
+if __name__ == "__main__":
+    main(sys.argv[1:] or SAMPLE_URLS)
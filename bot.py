@@ -1,16 +1,27 @@
-from pyrogram import Client, filters
+from pyrogram import Client, filters, enums, idle
 from pyrogram.types import InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery
 from config import *
 from random import choice
-import requests
 import re
 import json
-from difflib import SequenceMatcher
 import asyncio
-from http.server import BaseHTTPRequestHandler, HTTPServer
 import threading
 import time
 from urllib.parse import quote
+from jobs import post_queue, run_blocking
+from scoring import suggestion_scorer
+from images import prepare_image, remember_file_id, forget_file_id, record_sent, index_counts
+from catalog import catalog, alias_index, match_anime
+from cache import negative_cache, is_known_miss, remember_miss, metadata_cache, rendered_posts, recent_posts, swr_get, request_deadline
+from http_client import http_get, http_post, http_head, ping_url, pool_stats, HTTP_ERRORS
+from cassette import cassette
+from kitsu_index import KitsuIndex
+from resolver import Source, FieldResolver, LatencyTracker
+from deadline import Deadline, stage_timeout
+import snapshot
+from health import HealthServer, json_response, text_response, run_probe, run_debug
+from profiling import memory_profiler, format_report
+from state import state_backend, SessionStore, is_shared, run_state
 
 # Ensure the bot token is set correctly
 app = Client("ANIFLIX_POST_BOT", api_id=API_ID, api_hash=API_HASH, bot_token=BOT_TOKEN)
@@ -18,7 +29,10 @@ app = Client("ANIFLIX_POST_BOT", api_id=API_ID, api_hash=API_HASH, bot_token=BOT
 kitsu_api_url = "https://kitsu.io/api/edge"
 anilist_api_url = "https://graphql.anilist.co"
 anime_api_url = "https://raw.githubusercontent.com/OtakuFlix/ADATA/refs/heads/main/anime_data.txt"
-user_inputs = {}
+user_inputs = SessionStore(state_backend)
+
+# Known misses may stop being misses once the catalog changes
+catalog.listeners.append(lambda _: negative_cache.clear())
 
 # Default fallback image for when API calls fail
 DEFAULT_ANIME_IMAGE = "https://via.placeholder.com/800x600/34495e/ecf0f1?text=ANIFLIX"
@@ -30,63 +44,100 @@ season_bullets = {
     "16": "⓰", "17": "⓱", "18": "⓲", "19": "⓳", "20": "⓴"
 }
 
-# Health check endpoint
-class HealthCheckHandler(BaseHTTPRequestHandler):
-    def do_GET(self):
-        self.send_response(200)
-        self.send_header('Content-type', 'text/html')
-        self.end_headers()
-        self.wfile.write(b'OK - Bot is alive!')
+# Health check endpoints, served on the bot's event loop
+async def health_ok():
+    return text_response('OK - Bot is alive!')
+
+async def health_ready():
+    """Ready once the catalog is loaded and shared state is reachable; 503 until then"""
+    # The in-process backend answers instantly; only a shared one needs a network round trip
+    backend_ok = await run_probe(state_backend.ping) if is_shared() else state_backend.ping()
+    checks = {
+        "catalog": {"entries": len(catalog.records), "fresh": catalog.is_fresh(), "version": catalog.version},
+        "aliases": len(alias_index.aliases),
+        "state_backend": {"type": type(state_backend).__name__, "ok": backend_ok},
+        "metadata_cache": metadata_cache.stats(),
+        "rendered_posts": rendered_posts.stats(),
+        "kitsu_index": kitsu_index.stats(),
+        "sources": source_latency.stats(),
+    }
+    ready = bool(catalog.records) and backend_ok
+    return json_response({"ready": ready, **checks}, 200 if ready else 503)
+
+async def health_stats():
+    return json_response({
+        "http_pools": pool_stats(),
+        "post_queue": post_queue.stats(),
+        "metadata_cache": metadata_cache.stats(),
+        "rendered_posts": rendered_posts.stats(),
+        "source_latency": source_latency.stats(),
+        "cassette": cassette.stats(),
+        "health_requests": health_server.requests,
+    })
+
+async def health_memory():
+    # Public, so only the cheap counts; the gc walk and allocation diffs are for admins via /memory
+    return json_response(await run_debug(memory_profiler.report, 10, None, False))
+
+health_server = HealthServer({
+    "/ready": health_ready,
+    "/debug/stats": health_stats,
+    "/debug/memory": health_memory,
+    "/stats": health_stats,
+    "*": health_ok,
+}, port=10000)
 
-def keep_alive_pinger():
+async def keep_alive_pinger():
     """Ping the health check endpoint every 5 minutes to prevent sleep"""
-    time.sleep(60)  # Wait 1 minute before starting
+    await asyncio.sleep(60)  # Wait 1 minute before starting
     
     # Get the app URL from environment or use localhost for testing
     app_url = os.getenv('APP_URL', 'http://localhost:10000')
     
     while True:
         try:
-            response = requests.get(app_url, timeout=10)
+            # Our own URL is not an upstream: keep it out of the pooled clients and the cassette
+            response = await run_probe(ping_url, app_url, 10)
             print(f"[Keep-Alive] Pinged at {time.strftime('%Y-%m-%d %H:%M:%S')} - Status: {response.status_code}")
         except Exception as e:
             print(f"[Keep-Alive] Ping failed: {str(e)}")
         
         # Sleep for 5 minutes (250 seconds)
-        time.sleep(250)
-        
-def run_health_check_server():
-    server_address = ('', 10000)
-    httpd = HTTPServer(server_address, HealthCheckHandler)
-    httpd.serve_forever()
-
-def make_request_with_retry(url, timeout=10, max_retries=3):
-    """Make HTTP request with retry logic and proper error handling"""
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-    }
-    
+        await asyncio.sleep(250)
+
+def make_request_with_retry(url, timeout=10, max_retries=3, deadline=None):
+    """Make HTTP request over the pooled per-host client with retry logic, within the request deadline"""
     for attempt in range(max_retries):
+        attempt_timeout = stage_timeout(deadline, timeout)
+        if attempt_timeout is None:
+            print(f"Deadline reached before attempt {attempt + 1} for {url}")
+            break
         try:
-            response = requests.get(url, timeout=timeout, headers=headers)
+            response = http_get(url, timeout=attempt_timeout)
             if response.status_code == 200:
                 return response
             else:
                 print(f"Request failed with status {response.status_code}, attempt {attempt + 1}")
-        except requests.exceptions.RequestException as e:
+        except HTTP_ERRORS as e:
             print(f"Request error on attempt {attempt + 1}: {e}")
             if attempt < max_retries - 1:
-                time.sleep(2)  # Wait before retry
+                # Wait before retry, unless the wait alone would use up the budget
+                if deadline and deadline.remaining() <= 2:
+                    break
+                time.sleep(2)
     return None
 
-def validate_image_url(url):
+def validate_image_url(url, deadline=None):
     """Validate if image URL is accessible by Telegram"""
     if not url:
         return False
+    timeout = stage_timeout(deadline, 5)
+    if timeout is None:
+        return False
     
     try:
         # Check if URL is reachable and returns an image
-        response = requests.head(url, timeout=5)
+        response = http_head(url, timeout=timeout)
         content_type = response.headers.get('content-type', '').lower()
         
         # Check if it's an image and accessible
@@ -97,29 +148,60 @@ def validate_image_url(url):
     
     return False
 
-async def load_anime_cache():
-    """Load anime list for suggestions with error handling"""
+def refresh_catalog(force=False, deadline=None):
+    """Download the anime database unless the in-memory copy is still fresh"""
+    if not force and catalog.is_fresh():
+        return catalog
     try:
-        response = make_request_with_retry(anime_api_url)
+        response = make_request_with_retry(anime_api_url, deadline=deadline)
         if response:
-            data = response.json()
-            return [anime["name"] for anime in data]
+            catalog.load(response.json())
+            alias_index.save()
     except Exception as e:
-        print(f"Failed to load anime cache: {e}")
-    return []
-
-def similarity(a, b):
-    """Calculate similarity between two strings"""
-    return SequenceMatcher(None, a.lower(), b.lower()).ratio()
-
-def get_anime_suggestions(input_name, anime_list, limit=5):
-    """Get closest anime name suggestions"""
-    return [
-        anime for anime, _ in sorted(
-            [(anime, similarity(input_name, anime)) for anime in anime_list if similarity(input_name, anime) > 0.4],
-            key=lambda x: x[1], reverse=True
-        )[:limit]
-    ]
+        print(f"Failed to refresh anime catalog: {e}")
+    return catalog
+
+async def load_anime_cache():
+    """Load anime list for suggestions with error handling"""
+    if not catalog.is_fresh():
+        await run_blocking(refresh_catalog)
+    return catalog.names
+
+def build_alias_index():
+    """Opt-in: slowly pull AniList titles for every catalog anime so aliases cover the whole catalog"""
+    if ALIAS_BUILD_INTERVAL <= 0:
+        return
+    time.sleep(30)  # Let the bot start serving first
+    while True:
+        refresh_catalog()
+        pending = [name for name in catalog.names if alias_index.needs_titles(name)]
+        for count, name in enumerate(pending, 1):
+            # Straight to AniList: crawl results would only evict hot entries from the metadata cache
+            fetch_anilist_legacy(name)
+            alias_index.mark_attempted(name)
+            if count % 20 == 0:
+                alias_index.save()
+            time.sleep(ALIAS_BUILD_INTERVAL)
+        alias_index.save()
+        time.sleep(CATALOG_TTL)
+
+def save_alias_index_loop():
+    """Write aliases learned while rendering posts to disk, off the post path"""
+    while True:
+        time.sleep(ALIAS_SAVE_INTERVAL)
+        alias_index.save()
+
+async def warm_catalog():
+    """Load the catalog at startup, retrying until it arrives, so readiness doesn't wait for the first user"""
+    while True:
+        await load_anime_cache()
+        if catalog.records:
+            return
+        await asyncio.sleep(30)
+
+async def get_anime_suggestions_async(input_name, anime_list, limit=5):
+    """Get suggestions without blocking the bot, using the process pool for large catalogs"""
+    return await suggestion_scorer.suggest(input_name, anime_list, limit)
 
 def clean_html_tags(text):
     """Remove HTML tags from text and handle special characters"""
@@ -153,73 +235,103 @@ def truncate_synopsis(synopsis, max_length=200):
     return synopsis[:max_length]+"..."
 
 # Step 1: Get correct name/aid from your database
-def get_aid_for_anime(anime_name):
+def get_aid_for_anime(anime_name, deadline=None):
     """Get anime AID and poster from database with error handling"""
+    if is_known_miss("catalog", anime_name.lower()):
+        return None, None, None
     try:
-        response = make_request_with_retry(anime_api_url)
-        if response:
-            for anime in response.json():
-                if anime["name"].lower() == anime_name.lower():
-                    # Get the first poster URL if available
-                    poster_url = None
-                    if 'poster' in anime and anime['poster']:
-                        posters = [p.strip() for p in anime['poster'].split(',')]
-                        poster_url = posters[0] if posters else None
-                    return anime["name"], anime.get("aid"), poster_url
+        record = match_anime(anime_name) or match_anime_after_refresh(anime_name, deadline)
+        if record:
+            return record["name"], record["aid"], record["poster"]
+        if catalog.records:
+            remember_miss("catalog", anime_name.lower())
     except Exception as e:
         print("AID fetch error:", e)
     return None, None, None
 
-# Step 2: Get anilist id from anilist search
-def get_anilist_id(anime_name):
-    """Get AniList ID with error handling"""
-    query = '''
-    query ($search: String) { Media (search: $search, type: ANIME) { id } }
-    '''
-    try:
-        response = requests.post(
-            anilist_api_url,
-            json={'query': query, 'variables': {'search': anime_name}},
-            headers={'Content-Type': 'application/json'},
-            timeout=10
-        )
-        if response.status_code == 200:
-            data = response.json()
-            if data.get('data') and data['data'].get('Media'):
-                return data['data']['Media']['id']
-    except Exception as e:
-        print("AniList ID error:", e)
-    return None
+def catalog_details(anime_name, record=None, deadline=None):
+    """Name, aid and poster of an already selected catalog record, looking the name up only without one"""
+    if record:
+        return record["name"], record["aid"], record["poster"]
+    return get_aid_for_anime(anime_name, deadline)
+
+def match_anime_after_refresh(anime_name, deadline=None):
+    """Retry a catalog lookup once against a freshly refreshed catalog"""
+    if catalog.is_fresh() and catalog.records:
+        return None
+    refresh_catalog(deadline=deadline)
+    return match_anime(anime_name)
 
 # Step 3: Get AniZip Data (primary source)
-def fetch_ani_zip(anilist_id):
+def fetch_ani_zip(anilist_id, deadline=None):
+    """Compact ani.zip table served from the metadata cache"""
+    return swr_get(metadata_cache, ("anizip_table", anilist_id), lambda: download_ani_zip(anilist_id, request_deadline(deadline)))
+
+def compact_ani_zip(zip_data):
+    """Keep only what posts use: titles, and (title, overview, image, rating, season) indexed by episode number"""
+    episodes = zip_data.get('episodes')
+    table = {}
+    for key, ep_info in (episodes or {}).items():
+        if not str(key).isdigit() or not isinstance(ep_info, dict):
+            continue  # specials and other non-numbered entries are never requested
+        table[int(key)] = (
+            (ep_info.get('title') or {}).get('en'),
+            ep_info.get('overview'),
+            ep_info.get('image'),
+            str(ep_info['rating']) if ep_info.get('rating') else None,
+            ep_info.get('seasonNumber'),
+        )
+    rows = [None] * (max(table, default=0) + 1)
+    for number, row in table.items():
+        rows[number] = row
+    return {"titles": zip_data.get('titles') or {}, "has_episodes": episodes is not None, "episodes": tuple(rows)}
+
+def ani_zip_episode(table, episode_number):
+    """(title, overview, image, rating, season) for an episode, or None if ani.zip doesn't list it"""
+    episodes = table["episodes"]
+    return episodes[episode_number] if 0 <= episode_number < len(episodes) else None
+
+def download_ani_zip(anilist_id, deadline=None):
     """Fetch episode data from ani.zip API"""
+    timeout = stage_timeout(deadline, 10)
+    if timeout is None or is_known_miss("anizip", anilist_id):
+        return None
     try:
-        response = requests.get(f"https://api.ani.zip/mappings?anilist_id={anilist_id}", timeout=10)
+        response = http_get(f"https://api.ani.zip/mappings?anilist_id={anilist_id}", timeout=timeout)
         if response.status_code == 200:
-            return response.json()
+            return compact_ani_zip(response.json())
+        if response.status_code == 404:
+            remember_miss("anizip", anilist_id)
     except Exception as e:
         print("Ani.zip error:", e)
     return None
 
-def search_kitsu_anime(anime_name):
+def search_kitsu_anime(anime_name, deadline=None):
     """Search anime on Kitsu with error handling"""
+    if is_known_miss("kitsu_search", anime_name):
+        return None, None
     try:
         url = f"{kitsu_api_url}/anime?filter[text]={quote(anime_name)}"
-        response = make_request_with_retry(url)
+        response = make_request_with_retry(url, deadline=deadline)
         if response:
             data = response.json()
             if 'data' in data and data['data']:
                 return data['data'][0]['id'], data['data'][0]['attributes'].get('posterImage', {}).get('original')
+            remember_miss("kitsu_search", anime_name)
     except Exception as e:
         print(f"Kitsu search error: {e}")
     return None, None
 
-def fetch_kitsu_details(anime_id):
+def fetch_kitsu_details(anime_id, deadline=None):
+    """Kitsu details served from the metadata cache"""
+    details = swr_get(metadata_cache, ("kitsu_details", anime_id), lambda: load_kitsu_details(anime_id, request_deadline(deadline)))
+    return details or ("N/A", "No synopsis available", "finished", None, "N/A", [])
+
+def load_kitsu_details(anime_id, deadline=None):
     """Fetch Kitsu details with error handling"""
     try:
         url = f"{kitsu_api_url}/anime/{anime_id}"
-        response = make_request_with_retry(url)
+        response = make_request_with_retry(url, deadline=deadline)
         if response:
             data = response.json()
             if 'data' in data:
@@ -233,19 +345,29 @@ def fetch_kitsu_details(anime_id):
                 return rating, synopsis, d.get('status', '').lower(), d.get('posterImage', {}).get('original'), year, genres[:3]
     except Exception as e:
         print(f"Kitsu details error: {e}")
-    return "N/A", "No synopsis available", "finished", None, "N/A", []
+    return None
+
+def fetch_kitsu_json(url, deadline=None):
+    response = make_request_with_retry(url, deadline=deadline)
+    return response.json() if response else None
+
+kitsu_index = KitsuIndex(kitsu_api_url, fetch_kitsu_json)
 
-def fetch_episode_image(anime_id, episode_number):
-    """Fetch episode-specific image and synopsis from Kitsu with error handling"""
+def find_kitsu_anime(anime_name, anime_aid=None, deadline=None):
+    """Kitsu id and poster for a catalog anime, searching Kitsu only the first time"""
+    key = anime_aid or anime_name.lower()
+    cached = kitsu_index.lookup_anime(key)
+    if cached:
+        return cached
+    anime_id, poster_image = search_kitsu_anime(anime_name, deadline)
+    if anime_id:
+        kitsu_index.remember_anime(key, anime_id, poster_image)
+    return anime_id, poster_image
+
+def fetch_episode_image(anime_id, episode_number, deadline=None):
+    """Fetch episode-specific image and synopsis from the per-anime Kitsu episode index"""
     try:
-        url = f"{kitsu_api_url}/anime/{anime_id}/episodes?filter[number]={episode_number}"
-        response = make_request_with_retry(url)
-        if response:
-            data = response.json()
-            if 'data' in data and data['data']:
-                ep = data['data'][0]['attributes']
-                thumb = ep.get('thumbnail', {})
-                return thumb.get('original') if thumb else None, ep.get('synopsis', None)
+        return kitsu_index.get_episode(anime_id, episode_number, deadline)
     except Exception as e:
         print(f"Episode image fetch error: {e}")
     return None, None
@@ -254,13 +376,21 @@ def extract_season_number(anime_name):
     match = re.search(r'season (\d+)', anime_name, re.IGNORECASE)
     return match.group(1).zfill(2) if match else "01"
 
-def search_anilist_legacy(anime_name):
-    """Legacy AniList search for fallback data"""
+def search_anilist_legacy(anime_name, deadline=None):
+    """AniList search served from the metadata cache"""
+    return swr_get(metadata_cache, ("anilist", anime_name.lower()), lambda: fetch_anilist_legacy(anime_name, request_deadline(deadline)))
+
+def fetch_anilist_legacy(anime_name, deadline=None):
+    """AniList search for the id, alternate titles and fallback data in a single query"""
+    timeout = stage_timeout(deadline, 10)
+    if timeout is None or is_known_miss("anilist", anime_name):
+        return None
     query = '''
     query ($search: String) {
         Media (search: $search, type: ANIME) {
             id
             title { romaji english native }
+            synonyms
             bannerImage
             coverImage { extraLarge }
             averageScore
@@ -272,16 +402,21 @@ def search_anilist_legacy(anime_name):
     }
     '''
     try:
-        response = requests.post(
+        response = http_post(
             anilist_api_url,
             json={'query': query, 'variables': {'search': anime_name}},
             headers={'Content-Type': 'application/json'},
-            timeout=10
+            timeout=timeout
         )
         if response.status_code == 200:
             data = response.json()
+            if 'data' in data and not data['data']['Media']:
+                remember_miss("anilist", anime_name)
             if 'data' in data and data['data']['Media']:
                 m = data['data']['Media']
+                if catalog.get(anime_name):
+                    titles = list((m.get('title') or {}).values()) + (m.get('synonyms') or [])
+                    alias_index.add_titles(catalog.get(anime_name)["name"], titles)
                 year = m.get('startDate', {}).get('year') if m.get('startDate') else 'N/A'
                 return {
                     'id': m['id'],
@@ -297,159 +432,236 @@ def search_anilist_legacy(anime_name):
         print(f"AniList search error: {e}")
     return None
 
+# --------- Post metadata sources --------
+
+def source_anilist(ctx):
+    anilist_data = search_anilist_legacy(ctx["official_name"], ctx.get("deadline"))
+    if not anilist_data:
+        return {}
+    return {
+        "anilist_id": anilist_data['id'],
+        "synopsis": anilist_data.get('description'),
+        "rating": str(round(float(anilist_data['rating']) / 10, 2)) if anilist_data.get('rating') else None,
+        "genres": anilist_data.get('genres'),
+        "image": [anilist_data.get('banner'), anilist_data.get('cover')],
+    }
+
+def source_anizip(ctx):
+    episode_key = (ctx["anilist_id"], int(ctx["episode_number"]))
+    zip_table = fetch_ani_zip(ctx["anilist_id"], ctx.get("deadline"))
+    if not zip_table:
+        return {}
+    titles = zip_table["titles"]
+    alias_index.add_titles(ctx["official_name"], titles.values())
+    result = {"title": titles.get('en') or titles.get('x-jat')}
+    if is_known_miss("anizip_episode", episode_key):
+        # The table is cached anyway; only skip looking for an episode it is known to lack
+        return result
+    
+    ep_info = ani_zip_episode(zip_table, episode_key[1])
+    if zip_table["has_episodes"] and not ep_info:
+        # ani.zip lacks this episode; go straight to Kitsu now and next time
+        remember_miss("anizip_episode", episode_key)
+    if ep_info:
+        episode_title, overview, image, rating, season = ep_info
+        result.update({
+            "episode_title": episode_title,
+            "synopsis": overview,
+            "image": [image],
+            "rating": rating,
+            "season": season,
+        })
+    return result
+
+def source_kitsu_search(ctx):
+    anime_id, poster_image = find_kitsu_anime(ctx["official_name"], ctx.get("anime_aid"), ctx.get("deadline"))
+    return {"kitsu_id": anime_id, "image": [poster_image]}
+
+def source_kitsu_details(ctx):
+    kitsu_rating, anime_synopsis, airing_status, fallback_image, year, genres = fetch_kitsu_details(ctx["kitsu_id"], ctx.get("deadline"))
+    return {
+        "rating": kitsu_rating,
+        "synopsis": anime_synopsis if not anime_synopsis.startswith("No synopsis available") else None,
+        "genres": genres,
+        "image": [fallback_image],
+    }
+
+def source_kitsu_episode(ctx):
+    episode_image, episode_synopsis = fetch_episode_image(ctx["kitsu_id"], ctx["episode_number"], ctx.get("deadline"))
+    return {"synopsis": episode_synopsis, "image": [episode_image]}
+
+def source_catalog(ctx):
+    return {"image": [ctx.get("poster_url")]}
+
+def source_name(ctx):
+    return {"season": extract_season_number(ctx["official_name"])}
+
+def first_valid_image(candidates, ctx):
+    """First candidate image URL that Telegram will be able to fetch"""
+    deadline = ctx.get("deadline")
+    if deadline and deadline.expired():
+        # No time left to check; finalize_post still falls back if Telegram rejects it
+        return next((img_url for img_url in candidates if img_url), None)
+    for img_url in candidates:
+        if img_url and validate_image_url(img_url, ctx.get("deadline")):
+            return img_url
+    return None
+
+# Sources run in this order; free local ones last so they never delay a network answer
+POST_SOURCES = [
+    Source("anilist", source_anilist, ("anilist_id", "synopsis", "rating", "genres", "image")),
+    Source("anizip", source_anizip, ("title", "episode_title", "synopsis", "image", "rating", "season"), requires=("anilist_id",)),
+    Source("kitsu_search", source_kitsu_search, ("kitsu_id", "image")),
+    Source("kitsu_episode", source_kitsu_episode, ("synopsis", "image"), requires=("kitsu_id",)),
+    Source("kitsu_details", source_kitsu_details, ("rating", "synopsis", "genres", "image"), requires=("kitsu_id",)),
+    Source("catalog", source_catalog, ("image",)),
+    Source("name", source_name, ("season",)),
+]
+
+# Fields each post type needs, with the sources allowed to fill them in priority order
+WATCH_FIELDS = {
+    "title": ("anizip",),
+    "episode_title": ("anizip",),
+    "synopsis": ("anizip", "kitsu_episode", "anilist", "kitsu_details"),
+    "image": ("anizip", "catalog", "kitsu_episode", "anilist", "kitsu_details", "kitsu_search"),
+    "rating": ("anizip", "anilist", "kitsu_details"),
+    "season": ("anizip", "name"),
+}
+DOWNLOAD_FIELDS = {
+    "title": ("anizip",),
+    "synopsis": ("anizip", "anilist", "kitsu_details"),
+    "image": ("anizip", "kitsu_episode", "kitsu_details", "kitsu_search", "anilist", "catalog"),
+    "rating": ("anizip", "anilist", "kitsu_details"),
+    "genres": ("anilist", "kitsu_details"),
+    "season": ("anizip", "name"),
+}
+
+# When a source runs past its p95, fall back on an alternate's answer if it covers every field still needed.
+# AniList has always answered by then (ani.zip needs its anilist_id), so Kitsu is raced against that answer.
+# anizip is left out: it is the only source of title and episode_title, so no alternate could replace it.
+SOURCE_HEDGES = {
+    "kitsu_episode": "anilist",
+    "kitsu_details": "anilist",
+}
+
+source_latency = LatencyTracker()
+watch_resolver = FieldResolver(POST_SOURCES, WATCH_FIELDS, accept={"image": first_valid_image},
+                               hedges=SOURCE_HEDGES, latency=source_latency)
+download_resolver = FieldResolver(POST_SOURCES, DOWNLOAD_FIELDS, accept={"image": first_valid_image},
+                                  hedges=SOURCE_HEDGES, latency=source_latency)
+
+def resolve_post_fields(resolver, official_name, anime_aid, poster_url, episode_number, deadline=None):
+    """Fill the fields a post needs, querying as few upstream sources as possible within the deadline"""
+    ctx = {
+        "official_name": official_name,
+        "anime_aid": anime_aid,
+        "poster_url": poster_url,
+        "episode_number": episode_number,
+        "deadline": deadline,
+    }
+    fields, queried = resolver.resolve(ctx)
+    if deadline and deadline.expired():
+        print(f"Deadline reached for {official_name} episode {episode_number}, rendering partial post")
+    print(f"Resolved {official_name} episode {episode_number} via {queried}")
+    return fields
+
+def clean_source_note(synopsis):
+    """Drop the trailing '(Source: ...)' credit upstream synopses often carry"""
+    if synopsis and "Source:" in synopsis:
+        sidx = synopsis.find("(Source:")
+        eidx = synopsis.find(")", sidx)+1
+        if sidx > 0 and eidx > sidx: 
+            synopsis = synopsis.replace(synopsis[sidx:eidx], "").strip()
+    return synopsis
+
+def watch_caption(anime_title, episode_number, ep_title, season_number, rating, synopsis):
+    season_bullet = season_bullets.get(str(season_number).zfill(2), "⓪")
+    return (
+        f"⛩ **{anime_title}**\n"
+        f"✦ **{episode_number}** : {ep_title}\n"
+        f"┌───────────────────\n"
+        f"├ {season_bullet} 𝗦𝗲𝗮𝘀𝗼𝗻 : {str(season_number).zfill(2)}\n"
+        f"├ ⚅ 𝗘𝗽𝗶𝘀𝗼𝗱𝗲 : {episode_number}\n"
+        f"├ 𖦤 𝗔𝘂𝗱𝗶𝗼 : 𝗛𝗶𝗻𝗱𝗶 #𝗢𝗳𝗳𝗶𝗰𝗶𝗮𝗹\n"
+        f"├ ⌬ 𝗤𝘂𝗮𝗹𝗶𝘁𝘆 : 𝟭𝟬𝟴𝟬𝗽\n"
+        f"├ ✦ 𝗥𝗮𝘁𝗶𝗻𝗴 : {rating}/10\n"
+        f"├───────────────────\n"
+        f"├ ⚆ **Spoiler:**\n"
+        f"├ ||{synopsis}||\n"
+        f"├───────────────────\n"
+        f"├ ✧ Powered By ‧ [𝗔𝗡𝗜𝗙𝗟𝗜𝗫](https://t.me/ANIFLIX_OFFICIAL) ✧\n"
+        f"├ ⌲ Share ‧ [𝗦𝗛𝗔𝗥𝗘 𝗔𝗡𝗜𝗙𝗟𝗜𝗫](https://t.me/share/url?url=%F0%9F%8E%89+Join+@Aniflix_Official+for+the+best+Hindi+Dubbed+Anime!+Don't+miss+out+on+your+favorites,+all+in+one+place!+%F0%9F%8E%AC%E2%9C%A8) ✧\n"
+        f"└───────────────────\n"
+    )
+
+def download_caption(anime_title, episode_number, season_number, rating, genre_text, synopsis):
+    season_bullet = season_bullets.get(str(season_number).zfill(2), "❶")
+    return (
+        f"✨ **{anime_title}** ✨\n\n"
+        f"📺 **Episode:** {int(episode_number):02d}\n"
+        f"{season_bullet} **Season:** {season_number:02d}\n"
+        f"🎧 **Audio:** Multi Audio\n"
+        f"⭐️ **IMDb Rating:** {rating}/10\n"
+        f"🎭 **Genre:** {genre_text}\n\n"
+        f"🔥 **Synopsis:** {synopsis}\n\n"
+        f"👉 **Streaming on anime play Link Below** 👇"
+    )
+
+def is_cacheable_post(post):
+    """Only keep complete posts; misses and degraded posts are rebuilt next time"""
+    post_caption, image, _ = post
+    return not post_caption.startswith("No anime found") and image != DEFAULT_ANIME_IMAGE
+
+def render_post(command, anime_name, episode_number, deadline=None, record=None):
+    """Rendered post from cache, serving a stale copy while it is rebuilt in the background"""
+    builder = build_watch_post if command == "w" else build_download_post
+    key = (command, anime_name.lower(), str(episode_number))
+    
+    build_state = {"partial": False}
+    def build():
+        # Background refreshes have no user waiting, so they run without a budget
+        build_deadline = request_deadline(deadline or Deadline(POST_DEADLINE))
+        post = builder(anime_name, episode_number, build_deadline, record)
+        build_state["partial"] = bool(build_deadline and build_deadline.expired())
+        return post
+    
+    def should_cache(post):
+        # Partial posts built after the budget ran out are served but not kept
+        return is_cacheable_post(post) and not build_state["partial"]
+    
+    return swr_get(rendered_posts, key, build, should_cache=should_cache)
+
 # Unified post formatter for /w command (original format)
-async def format_watch_post(anime_name, episode_number):
+async def format_watch_post(anime_name, episode_number, deadline=None, record=None):
+    """Format watch post on the render pool so upstream calls don't block the bot"""
+    return await run_blocking(render_post, "w", anime_name, episode_number, deadline, record)
+
+def build_watch_post(anime_name, episode_number, deadline=None, record=None):
     """Format watch post with comprehensive error handling and ani.zip integration"""
     try:
         # 1. Get official name, aid, and poster URL
-        official_name, anime_aid, poster_url = get_aid_for_anime(anime_name)
+        official_name, anime_aid, poster_url = catalog_details(anime_name, record, deadline)
         if not official_name:
             return f"No anime found for '{anime_name}'.", DEFAULT_ANIME_IMAGE, None
 
-        # 2. Get Anilist ID from AniList
-        anilist_id = get_anilist_id(official_name)
-        if anilist_id:
-            # 3. Get Ani.zip data (PRIMARY SOURCE)
-            zip_data = fetch_ani_zip(anilist_id)
-            if zip_data and 'episodes' in zip_data:
-                ep_info = zip_data['episodes'].get(str(int(episode_number)))
-                titles = zip_data.get('titles', {})
-                anime_title = titles.get('en') or titles.get('x-jat') or official_name
-                ep_title = (ep_info and ep_info.get('title', {}).get('en')) or f'Episode {int(episode_number)}'
-                ep_summary = ep_info.get('overview') if ep_info else "No synopsis available."
-                ep_image = (ep_info.get('image') if ep_info else None) or poster_url
-                ep_rating = ep_info.get('rating', "N/A") if ep_info else "N/A"
-                season_number = ep_info.get('seasonNumber', 1) if ep_info else 1
-                season_bullet = season_bullets.get(str(season_number).zfill(2), "⓪")
-                synopsis = truncate_synopsis(format_spoiler_text(ep_summary))
-                
-                # Validate image URL before using
-                final_image = DEFAULT_ANIME_IMAGE
-                if ep_image and validate_image_url(ep_image):
-                    final_image = ep_image
-                elif poster_url and validate_image_url(poster_url):
-                    final_image = poster_url
-                
-                watch_url = f"https://aniflix.in/anime/info/{anime_aid}" if anime_aid else None
-                
-                post_caption = (
-                    f"⛩ **{anime_title}**\n"
-                    f"✦ **{episode_number}** : {ep_title}\n"
-                    f"┌───────────────────\n"
-                    f"├ {season_bullet} 𝗦𝗲𝗮𝘀𝗼𝗻 : {str(season_number).zfill(2)}\n"
-                    f"├ ⚅ 𝗘𝗽𝗶𝘀𝗼𝗱𝗲 : {episode_number}\n"
-                    f"├ 𖦤 𝗔𝘂𝗱𝗶𝗼 : 𝗛𝗶𝗻𝗱𝗶 #𝗢𝗳𝗳𝗶𝗰𝗶𝗮𝗹\n"
-                    f"├ ⌬ 𝗤𝘂𝗮𝗹𝗶𝘁𝘆 : 𝟭𝟬𝟴𝟬𝗽\n"
-                    f"├ ✦ 𝗥𝗮𝘁𝗶𝗻𝗴 : {ep_rating}/10\n"
-                    f"├───────────────────\n"
-                    f"├ ⚆ **Spoiler:**\n"
-                    f"├ ||{synopsis}||\n"
-                    f"├───────────────────\n"
-                    f"├ ✧ Powered By ‧ [𝗔𝗡𝗜𝗙𝗟𝗜𝗫](https://t.me/ANIFLIX_OFFICIAL) ✧\n"
-                    f"├ ⌲ Share ‧ [𝗦𝗛𝗔𝗥𝗘 𝗔𝗡𝗜𝗙𝗟𝗜𝗫](https://t.me/share/url?url=%F0%9F%8E%89+Join+@Aniflix_Official+for+the+best+Hindi+Dubbed+Anime!+Don't+miss+out+on+your+favorites,+all+in+one+place!+%F0%9F%8E%AC%E2%9C%A8) ✧\n"
-                    f"└───────────────────\n"
-                )
-                
-                # Handle caption length limit
-                while len(post_caption) > 1024:
-                    synopsis = truncate_synopsis(synopsis, len(synopsis) - 50)
-                    post_caption = (
-                        f"> ⛩ **{anime_title}**\n"
-                        f"✦ **{episode_number}** : {ep_title}\n"
-                        f"┌───────────────────\n"
-                        f"├ {season_bullet} 𝗦𝗲𝗮𝘀𝗼𝗻 : {str(season_number).zfill(2)}\n"
-                        f"├ ⚅ 𝗘𝗽𝗶𝘀𝗼𝗱𝗲 : {episode_number}\n"
-                        f"├ 𖦤 𝗔𝘂𝗱𝗶𝗼 : 𝗛𝗶𝗻𝗱𝗶 #𝗢𝗳𝗳𝗶𝗰𝗶𝗮𝗹\n"
-                        f"├ ⌬ 𝗤𝘂𝗮𝗹𝗶𝘁𝘆 : 𝟭𝟬𝟴𝟬𝗽\n"
-                        f"├ ✦ 𝗥𝗮𝘁𝗶𝗻𝗴 : {ep_rating}/10\n"
-                        f"├───────────────────\n"
-                        f"├ ⚆ **Spoiler:**\n"
-                        f"||{synopsis}||\n"
-                        f"├───────────────────\n"
-                        f"├ ✧ Powered By ‧ [𝗔𝗡𝗜𝗙𝗟𝗜𝗫](https://t.me/ANIFLIX_OFFICIAL) ✧\n"
-                        f"├ ⌲ Share ‧ [𝗦𝗛𝗔𝗥𝗘 𝗔𝗡𝗜𝗙𝗟𝗜𝗫](https://t.me/share/url?url=%F0%9F%8E%89+Join+@Aniflix_Official+for+the+best+Hindi+Dubbed+Anime!+Don't+miss+out+on+your+favorites,+all+in+one+place!+%F0%9F%8E%AC%E2%9C%A8) ✧\n"
-                        f"└───────────────────\n"
-                    )
-                
-                return post_caption, final_image, watch_url
-
-        # Fallback logic when ani.zip fails
-        print(f"Using fallback logic for {official_name}")
-        anime_id, poster_image = search_kitsu_anime(official_name)
-        if not anime_id:
-            return f"Failed to find anime '{official_name}' on Kitsu.", DEFAULT_ANIME_IMAGE, None
-            
-        kitsu_rating, anime_synopsis, airing_status, fallback_image, year, genres = fetch_kitsu_details(anime_id)
-        episode_image, episode_synopsis = fetch_episode_image(anime_id, episode_number)
-        anilist_data = search_anilist_legacy(official_name)
-        
-        # Image validation for fallback
-        final_image = DEFAULT_ANIME_IMAGE
-        image_candidates = [episode_image, 
-                           anilist_data and anilist_data.get('banner'), 
-                           anilist_data and anilist_data.get('cover'), 
-                           fallback_image, 
-                           poster_image]
-        
-        for img_url in image_candidates:
-            if img_url and validate_image_url(img_url):
-                final_image = img_url
-                break
-        
-        synopsis = episode_synopsis or (anime_synopsis if anime_synopsis != "No synopsis available." else "") or (anilist_data and anilist_data.get('description')) or "No synopsis available."
-        rating = kitsu_rating
-        if rating == "N/A" and anilist_data and anilist_data.get('rating'):
-            rating = str(round(float(anilist_data['rating']) / 10, 2))
-        
-        # Clean synopsis
-        if "Source:" in synopsis:
-            sidx = synopsis.find("(Source:")
-            eidx = synopsis.find(")", sidx)+1
-            if sidx > 0 and eidx > sidx: 
-                synopsis = synopsis.replace(synopsis[sidx:eidx], "").strip()
+        # 2. Resolve post fields, ani.zip first and other sources only for what it lacks
+        fields = resolve_post_fields(watch_resolver, official_name, anime_aid, poster_url, episode_number, deadline)
+        anime_title = fields["title"] or official_name
+        ep_title = fields["episode_title"] or f'Episode {int(episode_number)}'
+        season_number = int(fields["season"] or 1)
+        rating = fields["rating"] or "N/A"
+        final_image = fields["image"] or DEFAULT_ANIME_IMAGE
         
+        synopsis = clean_source_note(fields["synopsis"]) or "No synopsis available."
         synopsis = truncate_synopsis(format_spoiler_text(synopsis), 200)
-        season_number = extract_season_number(official_name)
-        season_bullet = season_bullets.get(season_number, "⓪")
         watch_url = f"https://aniflix.in/anime/info/{anime_aid}" if anime_aid else None
         
-        post_caption = (
-            f"> ⛩ **{official_name}**\n"
-            f"✦ **{episode_number}** : Episode {int(episode_number)}\n"
-            f"┌───────────────────\n"
-            f"├ {season_bullet} 𝗦𝗲𝗮𝘀𝗼𝗻 : {season_number}\n"
-            f"├ ⚅ 𝗘𝗽𝗶𝘀𝗼𝗱𝗲 : {episode_number}\n"
-            f"├ 𖦤 𝗔𝘂𝗱𝗶𝗼 : 𝗛𝗶𝗻𝗱𝗶 #𝗢𝗳𝗳𝗶𝗰𝗶𝗮𝗹\n"
-            f"├ ⌬ 𝗤𝘂𝗮𝗹𝗶𝘁𝘆 : 𝟭𝟬𝟴𝟬𝗽\n"
-            f"├ ✦ 𝗥𝗮𝘁𝗶𝗻𝗴 : {rating}/10 ‧ 𝗜𝗠𝗗𝗯\n"
-            f"├───────────────────\n"
-            f"├ ⚆ **Spoiler:**\n"
-            f"||{synopsis}||\n"
-            f"├───────────────────\n"
-            f"├ ✧ Powered By ‧ [𝗔𝗡𝗜𝗙𝗟𝗜𝗫](https://t.me/ANIFLIX_OFFICIAL) ✧\n"
-            f"├ ⌲ Share ‧ [𝗦𝗛𝗔𝗥𝗘 𝗔𝗡𝗜𝗙𝗟𝗜𝗫](https://t.me/share/url?url=%F0%9F%8E%89+Join+@Aniflix_Official+for+the+best+Hindi+Dubbed+Anime!+Don't+miss+out+on+your+favorites,+all+in+one+place!+%F0%9F%8E%AC%E2%9C%A8) ✧\n"
-            f"└───────────────────\n"
-        )
+        post_caption = watch_caption(anime_title, episode_number, ep_title, season_number, rating, synopsis)
         
+        # Handle caption length limit
         while len(post_caption) > 1024:
-            synopsis = truncate_synopsis(synopsis, len(synopsis)-50)
-            post_caption = (
-                f"> ⛩ **{official_name}**\n"
-                f"✦ **{episode_number}** : Episode {int(episode_number)}\n"
-                f"┌───────────────────\n"
-                f"├ {season_bullet} 𝗦𝗲𝗮𝘀𝗼𝗻 : {season_number}\n"
-                f"├ ⚅ 𝗘𝗽𝗶𝘀𝗼𝗱𝗲 : {episode_number}\n"
-                f"├ 𖦤 𝗔𝘂𝗱𝗶𝗼 : 𝗛𝗶𝗻𝗱𝗶 #𝗢𝗳𝗳𝗶𝗰𝗶𝗮𝗹\n"
-                f"├ ⌬ 𝗤𝘂𝗮𝗹𝗶𝘁𝘆 : 𝟭𝟬𝟴𝟬𝗽\n"
-                f"├ ✦ 𝗥𝗮𝘁𝗶𝗻𝗴 : {rating}/10 ‧ 𝗜𝗠𝗗𝗯\n"
-                f"├───────────────────\n"
-                f"├ ⚆ **Spoiler:**\n"
-                f"||{synopsis}||\n"
-                f"├───────────────────\n"
-                f"├ ✧ Powered By ‧ [𝗔𝗡𝗜𝗙𝗟𝗜𝗫](https://t.me/ANIFLIX_OFFICIAL) ✧\n"
-                f"├ ⌲ Share ‧ [𝗦𝗛𝗔𝗥𝗘 𝗔𝗡𝗜𝗙𝗟𝗜𝗫](https://t.me/share/url?url=%F0%9F%8E%89+Join+@Aniflix_Official+for+the+best+Hindi+Dubbed+Anime!+Don't+miss+out+on+your+favorites,+all+in+one+place!+%F0%9F%8E%AC%E2%9C%A8) ✧\n"
-                f"└───────────────────\n"
-            )
+            synopsis = truncate_synopsis(synopsis, len(synopsis) - 50)
+            post_caption = watch_caption(anime_title, episode_number, ep_title, season_number, rating, synopsis)
         
         return post_caption, final_image, watch_url
         
@@ -477,95 +689,25 @@ async def format_watch_post(anime_name, episode_number):
         )
 
 # UPDATED: Download post formatter for /d command with season information
-async def format_download_post(anime_name, episode_number):
+async def format_download_post(anime_name, episode_number, deadline=None, record=None):
+    """Format download post on the render pool so upstream calls don't block the bot"""
+    return await run_blocking(render_post, "d", anime_name, episode_number, deadline, record)
+
+def build_download_post(anime_name, episode_number, deadline=None, record=None):
     """Format download post with new alert-style format and season information"""
     try:
         # 1. Get official name, aid, and poster URL
-        official_name, anime_aid, poster_url = get_aid_for_anime(anime_name)
+        official_name, anime_aid, poster_url = catalog_details(anime_name, record, deadline)
         if not official_name:
             return f"No anime found for '{anime_name}'.", DEFAULT_ANIME_IMAGE, None
 
-        # 2. Get Anilist ID from AniList
-        anilist_id = get_anilist_id(official_name)
-        
-        # Initialize default values
-        anime_title = official_name
-        rating = "N/A"
-        synopsis = "No synopsis available."
-        year = "N/A"
-        genres = []
-        final_image = DEFAULT_ANIME_IMAGE
-        season_number = 1
-
-        if anilist_id:
-            # 3. Get Ani.zip data (PRIMARY SOURCE)
-            zip_data = fetch_ani_zip(anilist_id)
-            if zip_data:
-                titles = zip_data.get('titles', {})
-                anime_title = titles.get('en') or titles.get('x-jat') or official_name
-                
-                # Get episode info if available
-                if 'episodes' in zip_data:
-                    ep_info = zip_data['episodes'].get(str(int(episode_number)))
-                    if ep_info:
-                        ep_summary = ep_info.get('overview')
-                        if ep_summary:
-                            synopsis = ep_summary
-                        ep_image = ep_info.get('image')
-                        if ep_image and validate_image_url(ep_image):
-                            final_image = ep_image
-                        ep_rating = ep_info.get('rating')
-                        if ep_rating:
-                            rating = str(ep_rating)
-                        # Get season number from episode data
-                        season_number = ep_info.get('seasonNumber', 1)
-
-        # Fallback to other APIs if needed
-        anime_id, poster_image = search_kitsu_anime(official_name)
-        if anime_id:
-            kitsu_rating, anime_synopsis, airing_status, fallback_image, kitsu_year, kitsu_genres = fetch_kitsu_details(anime_id)
-            
-            # Use kitsu data if not already populated
-            if rating == "N/A":
-                rating = kitsu_rating
-            if synopsis == "No synopsis available." and anime_synopsis != "No synopsis available.":
-                synopsis = anime_synopsis
-            if year == "N/A":
-                year = kitsu_year
-            if not genres:
-                genres = kitsu_genres
-            
-            # Try episode-specific image
-            episode_image, episode_synopsis = fetch_episode_image(anime_id, episode_number)
-            if episode_image and validate_image_url(episode_image) and final_image == DEFAULT_ANIME_IMAGE:
-                final_image = episode_image
-            elif fallback_image and validate_image_url(fallback_image) and final_image == DEFAULT_ANIME_IMAGE:
-                final_image = fallback_image
-            elif poster_image and validate_image_url(poster_image) and final_image == DEFAULT_ANIME_IMAGE:
-                final_image = poster_image
-
-        # Try AniList for additional data
-        anilist_data = search_anilist_legacy(official_name)
-        if anilist_data:
-            if rating == "N/A" and anilist_data.get('rating'):
-                rating = str(round(float(anilist_data['rating']) / 10, 2))
-            if synopsis == "No synopsis available." and anilist_data.get('description'):
-                synopsis = anilist_data['description']
-            if year == "N/A" and anilist_data.get('year'):
-                year = str(anilist_data['year'])
-            if not genres and anilist_data.get('genres'):
-                genres = anilist_data['genres'][:3]
-            
-            # Try AniList images
-            if final_image == DEFAULT_ANIME_IMAGE:
-                if anilist_data.get('banner') and validate_image_url(anilist_data['banner']):
-                    final_image = anilist_data['banner']
-                elif anilist_data.get('cover') and validate_image_url(anilist_data['cover']):
-                    final_image = anilist_data['cover']
-
-        # Final fallback for poster
-        if final_image == DEFAULT_ANIME_IMAGE and poster_url and validate_image_url(poster_url):
-            final_image = poster_url
+        # 2. Resolve post fields, stopping as soon as every one is filled
+        fields = resolve_post_fields(download_resolver, official_name, anime_aid, poster_url, episode_number, deadline)
+        anime_title = fields["title"] or official_name
+        rating = fields["rating"] or "N/A"
+        genres = (fields["genres"] or [])[:3]
+        final_image = fields["image"] or DEFAULT_ANIME_IMAGE
+        season_number = int(fields["season"] or 1)
 
         # Extract season from name if not found in API data
         if season_number == 1:
@@ -573,12 +715,7 @@ async def format_download_post(anime_name, episode_number):
             season_number = int(extracted_season) if extracted_season != "01" else 1
 
         # Clean and format synopsis
-        if "Source:" in synopsis:
-            sidx = synopsis.find("(Source:")
-            eidx = synopsis.find(")", sidx)+1
-            if sidx > 0 and eidx > sidx: 
-                synopsis = synopsis.replace(synopsis[sidx:eidx], "").strip()
-        
+        synopsis = clean_source_note(fields["synopsis"]) or "No synopsis available."
         synopsis = clean_html_tags(synopsis)
         synopsis = truncate_synopsis(synopsis, 150)  # Shorter for download format
         
@@ -588,34 +725,13 @@ async def format_download_post(anime_name, episode_number):
         # Create download URL
         download_url = f"https://www.animeplay.icu/search?q={anime_title.replace(' ', '%20')}"
         
-        # Get season bullet
-        season_bullet = season_bullets.get(str(season_number).zfill(2), "❶")
-        
         # Create the new download post format with season information
-        post_caption = (
-            f"✨ **{anime_title}** ✨\n\n"
-            f"📺 **Episode:** {int(episode_number):02d}\n"
-            f"{season_bullet} **Season:** {season_number:02d}\n"
-            f"🎧 **Audio:** Multi Audio\n"
-            f"⭐️ **IMDb Rating:** {rating}/10\n"
-            f"🎭 **Genre:** {genre_text}\n\n"
-            f"🔥 **Synopsis:** {synopsis}\n\n"
-            f"👉 **Streaming on anime play Link Below** 👇"
-        )
+        post_caption = download_caption(anime_title, episode_number, season_number, rating, genre_text, synopsis)
         
         # Handle caption length limit
         while len(post_caption) > 1024:
             synopsis = truncate_synopsis(synopsis, len(synopsis) - 30)
-            post_caption = (
-                f"✨ **{anime_title}** ✨\n\n"
-                f"📺 **Episode:** {int(episode_number):02d}\n"
-                f"{season_bullet} **Season:** {season_number:02d}\n"
-                f"🎧 **Audio:** Multi Audio\n"
-                f"⭐️ **IMDb Rating:** {rating}/10\n"
-                f"🎭 **Genre:** {genre_text}\n\n"
-                f"🔥 **Synopsis:** {synopsis}\n\n"
-                f"👉 **Streaming on anime play Link Below** 👇"
-            )
+            post_caption = download_caption(anime_title, episode_number, season_number, rating, genre_text, synopsis)
         
         return post_caption, final_image, download_url
         
@@ -678,12 +794,12 @@ async def start_command(Client, message):
 async def anime_command(client, message):
     """Handle /anime command - works like /w but optimized for groups"""
     try:
-        # Debug: Print message details
-        print(f"Received message: {message}")
-        print(f"Message type: {type(message)}")
-        print(f"Message chat: {getattr(message, 'chat', 'No chat')}")
-        print(f"Message from_user: {getattr(message, 'from_user', 'No from_user')}")
-        print(f"Message sender_chat: {getattr(message, 'sender_chat', 'No sender_chat')}")
+        # Debug: log who sent it; full Message reprs are several KB each
+        print(
+            f"Received /anime in chat {getattr(getattr(message, 'chat', None), 'id', None)} "
+            f"from user {getattr(getattr(message, 'from_user', None), 'id', None)} "
+            f"sender_chat {getattr(getattr(message, 'sender_chat', None), 'id', None)}"
+        )
         
         # Try to get user ID from different sources
         user_id = None
@@ -727,36 +843,34 @@ async def anime_command(client, message):
             anime_input = command_parts[1].strip()
             print(f"Searching for anime: {anime_input}")
             
-            # Check for exact match first
-            exact_match = None
-            for anime in anime_cache:
-                if anime.lower() == anime_input.lower():
-                    exact_match = anime
-                    break
+            # Check for exact or alias match first
+            record = match_anime(anime_input)
+            exact_match = record["name"] if record else None
             
             if exact_match:
                 print(f"Found exact match: {exact_match}")
                 import time
-                user_inputs[user_id] = {
+                session = {
                     "command": "w",  # Use watch format
-                    "anime_name": exact_match,
                     "timestamp": time.time()
                 }
+                select_anime(session, record)
+                await run_state(user_inputs.set, user_id, session)
                 await message.reply_text(f"✅ **Selected:** {exact_match}\n\nPlease send me the episode number:")
             else:
                 # Look for suggestions
                 print(f"No exact match, looking for suggestions...")
-                suggestions = get_anime_suggestions(anime_input, anime_cache)
+                suggestions = await get_anime_suggestions_async(anime_input, anime_cache)
                 print(f"Found {len(suggestions)} suggestions: {suggestions}")
                 
                 if suggestions:
                     import time
-                    user_inputs[user_id] = {
+                    await run_state(user_inputs.set, user_id, {
                         "command": "w",
                         "timestamp": time.time()
-                    }
+                    })
                     buttons = [
-                        [InlineKeyboardButton(f"📺 {s}", callback_data=f"suggest_{s}")]
+                        [InlineKeyboardButton(f"📺 {s}", callback_data=suggestion_callback(s))]
                         for s in suggestions[:5]
                     ]
                     await message.reply_text(
@@ -774,10 +888,10 @@ async def anime_command(client, message):
             # No anime name provided, ask for it
             print("No anime name provided, asking user")
             import time
-            user_inputs[user_id] = {
+            await run_state(user_inputs.set, user_id, {
                 "command": "w",
                 "timestamp": time.time()
-            }
+            })
             await message.reply_text("🎬 **ANIFLIX Anime Search**\n\nPlease send me the anime name:")
             
     except Exception as e:
@@ -807,10 +921,10 @@ async def request_anime_name(client, message):
             return
             
         import time
-        user_inputs[user_id] = {
+        await run_state(user_inputs.set, user_id, {
             "command": message.command[0],
             "timestamp": time.time()
-        }
+        })
         
         command_text = "watch" if message.command[0] == "w" else "download"
         await message.reply_text(f"🎬 **ANIFLIX {command_text.title()} Search**\n\nPlease send me the anime name:")
@@ -819,15 +933,46 @@ async def request_anime_name(client, message):
         print(f"Error in request_anime_name: {e}")
         await message.reply_text("❌ Something went wrong! Please try again.")
 
+def suggestion_callback(anime_name):
+    """Callback data for a suggestion button: the catalog id, or the title for names outside the catalog"""
+    record = catalog.get(anime_name)
+    catalog_id = catalog.id_for(record) if record else None
+    if catalog_id:
+        return f"suggest_{catalog_id}"
+    # Telegram rejects callback data over 64 bytes
+    return f"suggest_{anime_name}".encode()[:64].decode(errors="ignore")
+
+def select_anime(user_data, record):
+    """Store a catalog selection so the post is built without matching the name again"""
+    user_data["anime_name"] = record["name"]
+    user_data["record"] = record
+
 @app.on_callback_query(filters.regex("^suggest_"))
 async def handle_suggestion_callback(client, callback_query: CallbackQuery):
     try:
-        anime_name = callback_query.data.split("suggest_", 1)[1]
+        payload = callback_query.data.split("suggest_", 1)[1]
+        # A fresh process or another replica may not have loaded the catalog the ids came from yet
+        await load_anime_cache()
+        # Buttons sent before catalog ids existed still carry the title
+        record = catalog.get_by_id(int(payload)) if payload.isdigit() else match_anime(payload)
+        if record is None and payload.isdigit():
+            # The show left the catalog since the buttons were sent; an id is no use as a title
+            await callback_query.edit_message_text(
+                "❌ **That anime is no longer available!**\n\n"
+                "Please search again with `/w`, `/d`, or `/anime`"
+            )
+            return
+        anime_name = record["name"] if record else payload
         user_id = callback_query.from_user.id
         
         # Check if user has an active session
-        if user_id in user_inputs:
-            user_inputs[user_id]["anime_name"] = anime_name
+        session = await run_state(user_inputs.get, user_id)
+        if session is not None:
+            if record:
+                select_anime(session, record)
+            else:
+                session["anime_name"] = anime_name
+            await run_state(user_inputs.set, user_id, session)
             await callback_query.edit_message_text(
                 f"✅ **Selected:** {anime_name}\n\nPlease send me the episode number:"
             )
@@ -841,6 +986,26 @@ async def handle_suggestion_callback(client, callback_query: CallbackQuery):
         print(f"Error in suggestion callback: {e}")
         await callback_query.answer("❌ Something went wrong!", show_alert=True)
 
+@app.on_message(filters.command(["memory"]) & filters.user(ADMIN_IDS))
+async def memory_command(client, message):
+    """Admin-only memory report: /memory, /memory start, /memory stop"""
+    try:
+        action = message.command[1].lower() if len(message.command) > 1 else "report"
+        if action == "start":
+            await run_blocking(memory_profiler.start)
+            await message.reply_text("🧠 Memory tracing started. Send /memory later to see growth since now.")
+            return
+        if action == "stop":
+            memory_profiler.stop()
+            await message.reply_text("🧠 Memory tracing stopped.")
+            return
+        # Each admin gets growth since their own previous /memory
+        report = await run_blocking(memory_profiler.report, 10, f"telegram:{message.from_user.id}")
+        await message.reply_text(f"```\n{format_report(report)}\n```")
+    except Exception as e:
+        print(f"Error in memory_command: {e}")
+        await message.reply_text("❌ Could not build the memory report.")
+
 @app.on_message(filters.text & ~filters.command(["w", "start", "anime"]))
 async def capture_input(client, message):
     try:
@@ -854,19 +1019,18 @@ async def capture_input(client, message):
         elif hasattr(message, 'chat') and message.chat and hasattr(message.chat, 'id'):
             user_id = message.chat.id
             
-        if not user_id or user_id not in user_inputs:
+        user_data = await run_state(user_inputs.get, user_id) if user_id else None
+        if user_data is None:
             # User doesn't have an active session, ignore the message
             return
         
-        user_data = user_inputs[user_id]
-        
         # Add timeout check (optional - removes sessions older than 10 minutes)
         import time
         current_time = time.time()
         if 'timestamp' not in user_data:
             user_data['timestamp'] = current_time
         elif current_time - user_data['timestamp'] > 600:  # 10 minutes
-            del user_inputs[user_id]
+            await run_state(user_inputs.discard, user_id)
             await message.reply_text(
                 "❌ **Session expired!**\n\n"
                 "Please start again with `/w`, `/d`, or `/anime` command."
@@ -875,27 +1039,26 @@ async def capture_input(client, message):
         
         # Update timestamp
         user_data['timestamp'] = current_time
+        await run_state(user_inputs.set, user_id, user_data)
         
         anime_cache = await load_anime_cache()
         
         if "anime_name" not in user_data:
             anime_input = message.text.strip()
-            exact_match = None
-            for anime in anime_cache:
-                if anime.lower() == anime_input.lower():
-                    exact_match = anime
-                    break
+            record = match_anime(anime_input)
+            exact_match = record["name"] if record else None
             
             if exact_match:
-                user_data["anime_name"] = exact_match
+                select_anime(user_data, record)
+                await run_state(user_inputs.set, user_id, user_data)
                 await message.reply_text(
                     f"✅ **Selected:** {exact_match}\n\nPlease send me the episode number:"
                 )
             else:
-                suggestions = get_anime_suggestions(anime_input, anime_cache)
+                suggestions = await get_anime_suggestions_async(anime_input, anime_cache)
                 if suggestions:
                     buttons = [
-                        [InlineKeyboardButton(f"📺 {s}", callback_data=f"suggest_{s}")]
+                        [InlineKeyboardButton(f"📺 {s}", callback_data=suggestion_callback(s))]
                         for s in suggestions[:5]
                     ]
                     await message.reply_text(
@@ -917,7 +1080,8 @@ async def capture_input(client, message):
                     raise ValueError("Episode number must be positive")
                     
                 user_data["episode_number"] = str(episode_num).zfill(2)
-                await finalize_post(client, message, user_data)
+                await run_state(user_inputs.set, user_id, user_data)
+                await enqueue_post(client, message, user_data)
             except ValueError:
                 await message.reply_text(
                     "❌ **Invalid episode number!**\n\n"
@@ -926,8 +1090,8 @@ async def capture_input(client, message):
                 
     except Exception as e:
         print(f"Error in capture_input: {e}")
-        if user_id and user_id in user_inputs:
-            del user_inputs[user_id]  # Clean up on error
+        if user_id:
+            await run_state(user_inputs.discard, user_id)  # Clean up on error
         await message.reply_text(
             "❌ **Something went wrong!**\n\n"
             "Please start again with `/w`, `/d`, or `/anime` command."
@@ -947,8 +1111,7 @@ async def cancel_command(client, message):
         elif hasattr(message, 'chat') and message.chat and hasattr(message.chat, 'id'):
             user_id = message.chat.id
             
-        if user_id and user_id in user_inputs:
-            del user_inputs[user_id]
+        if user_id and await run_state(user_inputs.discard, user_id):
             await message.reply_text(
                 "✅ **Session cancelled successfully!**\n\n"
                 "You can now start fresh with `/w`, `/d`, or `/anime` command."
@@ -963,6 +1126,92 @@ async def cancel_command(client, message):
         print(f"Error in cancel_command: {e}")
         await message.reply_text("❌ Something went wrong while cancelling the session.")
 
+def post_key(chat_id, user_data):
+    return (chat_id, user_data["command"], user_data["anime_name"].lower(), user_data["episode_number"])
+
+def is_group_chat(message):
+    chat = getattr(message, 'chat', None)
+    return bool(chat) and chat.type in (enums.ChatType.GROUP, enums.ChatType.SUPERGROUP)
+
+async def remember_group_post(message, user_data, sent):
+    """Index a post sent to a group so repeat requests can point at it"""
+    if not is_group_chat(message) or not hasattr(sent, 'id'):
+        return
+    # Only supergroups have message links; basic groups still get a reply to the post
+    link = sent.link if message.chat.type == enums.ChatType.SUPERGROUP else None
+    await run_state(recent_posts.set, post_key(message.chat.id, user_data), (sent.id, link))
+
+async def reply_with_recent_post(message, message_id, link):
+    """Point a repeat request at the copy of the post already in the chat"""
+    text = "📌 **This post was just shared here.** Tap the message above to see it."
+    buttons = InlineKeyboardMarkup([[InlineKeyboardButton("↗ Open post", url=link)]]) if link else None
+    try:
+        await message.reply_text(text, reply_to_message_id=message_id, reply_markup=buttons)
+    except Exception as e:
+        # The earlier post may have been deleted; fall back to a plain reply
+        print(f"Reply to recent post {message_id} failed: {e}")
+        await message.reply_text(text, reply_markup=buttons)
+
+async def enqueue_post(client, message, user_data):
+    """Hand a completed request to the post queue, telling the user when it has to wait"""
+    user_id = None
+    if hasattr(message, 'from_user') and message.from_user and hasattr(message.from_user, 'id'):
+        user_id = message.from_user.id
+    elif hasattr(message, 'sender_chat') and message.sender_chat and hasattr(message.sender_chat, 'id'):
+        user_id = message.sender_chat.id
+    chat_id = message.chat.id if getattr(message, 'chat', None) else user_id
+    if not user_id:
+        user_id = chat_id
+    
+    key = post_key(chat_id, user_data)
+    if is_group_chat(message):
+        recent = await run_state(recent_posts.get, key)
+        if recent:
+            await run_state(user_inputs.discard, user_id)
+            await reply_with_recent_post(message, *recent)
+            return
+    status, position = post_queue.submit(chat_id, key, lambda: finalize_post(client, message, user_data))
+    
+    if status == "started":
+        return
+    if status == "queued":
+        await message.reply_text(f"⏳ **Queued, position {position}.** Your post will be sent shortly.")
+        return
+    
+    # Nothing new was queued for this session, so close it here
+    await run_state(user_inputs.discard, user_id)
+    if status == "duplicate":
+        if position:
+            await message.reply_text(f"⏳ **Already queued, position {position}.** This post is on its way.")
+        else:
+            await message.reply_text("⏳ **This post is already being prepared.** It will appear shortly.")
+    else:
+        await message.reply_text(
+            "🚦 **Too many requests right now!**\n\n"
+            "Please try again in a minute with `/w`, `/d`, or `/anime` command."
+        )
+
+async def send_prepared_photo(message, prepared, caption, buttons):
+    """Send a cached image, reusing Telegram's file_id when it has been uploaded before; returns the sent message"""
+    if prepared.file_id:
+        try:
+            sent = await message.reply_photo(prepared.file_id, caption=caption, reply_markup=InlineKeyboardMarkup(buttons))
+            record_sent(prepared)
+            return sent
+        except Exception as e:
+            print(f"Cached file_id send failed, re-uploading: {e}")
+            forget_file_id(prepared)
+    
+    try:
+        sent = await message.reply_photo(prepared.path, caption=caption, reply_markup=InlineKeyboardMarkup(buttons))
+        record_sent(prepared)
+        if sent and sent.photo:
+            remember_file_id(prepared, sent.photo.file_id)
+        return sent
+    except Exception as e:
+        print(f"Cached image upload failed: {e}")
+    return None
+
 async def finalize_post(client, message, user_data):
     try:
         # Get user ID using consistent method
@@ -984,14 +1233,15 @@ async def finalize_post(client, message, user_data):
         command = user_data["command"]
         
         print(f"Finalizing post for user {user_id}: {anime_name} episode {episode_number}")
+        deadline = Deadline(POST_DEADLINE)
         
         # Use different formatters based on command
         if command == "w":
-            post_caption, episode_image, watch_url = await format_watch_post(anime_name, episode_number)
+            post_caption, episode_image, watch_url = await format_watch_post(anime_name, episode_number, deadline, user_data.get("record"))
             action_url = watch_url
             button_text = "✦ ＷＡＴＣＨ  ＮＯＷ ✦"
         else:  # command == "d"
-            post_caption, episode_image, download_url = await format_download_post(anime_name, episode_number)
+            post_caption, episode_image, download_url = await format_download_post(anime_name, episode_number, deadline, user_data.get("record"))
             action_url = download_url
             button_text = "✦ WATCH | DOWNLOAD ✦"
         
@@ -1006,11 +1256,21 @@ async def finalize_post(client, message, user_data):
 
         # Try multiple approaches for image sending
         image_sent = False
+        sent = None
         
-        # First try with the fetched image
+        # First try with the fetched image, downsized and cached locally
         if episode_image and episode_image != DEFAULT_ANIME_IMAGE:
+            prepared = await run_blocking(prepare_image, episode_image, deadline)
+            if prepared:
+                sent = await send_prepared_photo(message, prepared, post_caption, buttons)
+                image_sent = bool(sent)
+                if image_sent:
+                    print(f"Successfully sent post with cached image for {anime_name}")
+        
+        # Let Telegram fetch the remote image if the local pipeline couldn't
+        if not image_sent and episode_image and episode_image != DEFAULT_ANIME_IMAGE:
             try:
-                await message.reply_photo(
+                sent = await message.reply_photo(
                     episode_image, 
                     caption=post_caption, 
                     reply_markup=InlineKeyboardMarkup(buttons)
@@ -1023,7 +1283,7 @@ async def finalize_post(client, message, user_data):
         # If primary image failed, try with default placeholder
         if not image_sent:
             try:
-                await message.reply_photo(
+                sent = await message.reply_photo(
                     DEFAULT_ANIME_IMAGE, 
                     caption=post_caption, 
                     reply_markup=InlineKeyboardMarkup(buttons)
@@ -1035,15 +1295,16 @@ async def finalize_post(client, message, user_data):
         
         # Final fallback: send as text message
         if not image_sent:
-            await message.reply_text(
+            sent = await message.reply_text(
                 post_caption, 
                 reply_markup=InlineKeyboardMarkup(buttons)
             )
             print(f"Successfully sent post as text message for {anime_name}")
+        
+        await remember_group_post(message, user_data, sent)
 
         # Clean up user data
-        if user_id in user_inputs:
-            del user_inputs[user_id]
+        if await run_state(user_inputs.discard, user_id):
             print(f"Cleaned up session for user {user_id}")
 
     except Exception as e:
@@ -1062,8 +1323,7 @@ async def finalize_post(client, message, user_data):
             elif hasattr(message, 'chat') and message.chat and hasattr(message.chat, 'id'):
                 cleanup_user_id = message.chat.id
                 
-            if cleanup_user_id and cleanup_user_id in user_inputs:
-                del user_inputs[cleanup_user_id]
+            if cleanup_user_id and await run_state(user_inputs.discard, cleanup_user_id):
                 print(f"Cleaned up session after error for user {cleanup_user_id}")
         except:
             pass
@@ -1080,16 +1340,71 @@ async def finalize_post(client, message, user_data):
         except Exception as reply_error:
             print(f"Failed to send error message: {reply_error}")
 
-if __name__ == "__main__":
-    # Start the health check server in a separate thread
-    threading.Thread(target=run_health_check_server, daemon=True).start()
+def register_memory_counters():
+    """Sizes of the containers most likely to grow over days"""
+    memory_profiler.register("catalog_records", lambda: len(catalog.records))
+    memory_profiler.register("catalog_ids", lambda: len(catalog.by_id))
+    memory_profiler.register("aliases", lambda: len(alias_index.aliases))
+    memory_profiler.register("negative_cache", lambda: len(negative_cache))
+    for name, cache in (("metadata_cache", metadata_cache), ("rendered_posts", rendered_posts), ("recent_posts", recent_posts)):
+        # Shared caches live in the state backend, not in this process
+        memory_profiler.register(name, lambda cache=cache: len(cache) if hasattr(cache, "__len__") else "shared")
+    memory_profiler.register("sessions", lambda: "shared" if is_shared() else state_backend.count("session:"))
+    memory_profiler.register("kitsu_anime_ids", lambda: len(kitsu_index.anime_ids))
+    memory_profiler.register("kitsu_episode_tables", lambda: len(kitsu_index.episodes))
+    memory_profiler.register("image_index", index_counts)
+    memory_profiler.register("post_queue", lambda: post_queue.queued)
+
+register_memory_counters()
+
+def register_snapshot_state():
+    """Everything worth keeping warm across a restart"""
+    snapshot.register("catalog", catalog.dump, catalog.restore)
+    snapshot.register("negative_cache", negative_cache.dump, negative_cache.restore)
+    snapshot.register("kitsu_index", kitsu_index.dump, kitsu_index.restore)
+    snapshot.register("source_latency", source_latency.dump, source_latency.restore)
+    if is_shared():
+        # Sessions and shared caches already outlive this process in the state backend
+        return
+    snapshot.register("metadata_cache", metadata_cache.dump, metadata_cache.restore)
+    snapshot.register("rendered_posts", rendered_posts.dump, rendered_posts.restore)
+    snapshot.register("recent_posts", recent_posts.dump, recent_posts.restore)
+    snapshot.register("state", state_backend.dump, state_backend.restore)
+
+async def main():
+    """Serve health probes as soon as the loop starts, then run the bot until it is stopped"""
+    await health_server.start()
+    pinger = asyncio.get_running_loop().create_task(keep_alive_pinger())
+    warmup = asyncio.get_running_loop().create_task(warm_catalog())
+    print("Health check server and keep-alive pinger are running on port 10000")
     
-    # Start keep-alive pinger in a separate thread
-    keep_alive_thread = threading.Thread(target=keep_alive_pinger)
-    keep_alive_thread.daemon = True
-    keep_alive_thread.start()
+    await app.start()
+    try:
+        await idle()
+    finally:
+        pinger.cancel()
+        warmup.cancel()
+        await app.stop()
+        await health_server.close()
+
+def run():
+    """Start the bot; main.py calls this so the process's main module stays light"""
+    # Restore caches and sessions from the last run before taking any updates
+    register_snapshot_state()
+    snapshot.load_snapshot()
+    threading.Thread(target=snapshot.snapshot_loop, daemon=True).start()
+    
+    # Fill the alias index from AniList in the background
+    threading.Thread(target=build_alias_index, daemon=True).start()
+    threading.Thread(target=save_alias_index_loop, daemon=True).start()
     
     print("Bot is starting...")
-    print("Health check server and keep-alive pinger are running on port 10000")
     
-    app.run()
+    try:
+        app.run(main())
+    finally:
+        snapshot.save_snapshot()
+        alias_index.save()
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,227 @@
+import threading
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from concurrent.futures import ThreadPoolExecutor
+from state import state_backend, is_shared
+from config import NEGATIVE_CACHE_TTL, METADATA_TTL, METADATA_MAX_STALE, POST_CACHE_TTL, POST_MAX_STALE, RECENT_POST_WINDOW
+
+MISSING = object()
+
+class TTLCache:
+    """Thread-safe, size-bounded key/value cache whose entries expire after ttl seconds"""
+
+    def __init__(self, ttl, max_entries=10000, max_stale=0):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_stale = max_stale  # how long past expiry an entry may still be served stale
+        self.entries = OrderedDict()  # key -> (value, expires_at)
+        self.refreshing = set()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    def get_entry(self, key):
+        """Return (value, fresh) for a servable entry, or (MISSING, False)"""
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[1] + self.max_stale < now:
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return MISSING, False
+            self.entries.move_to_end(key)
+            if entry[1] >= now:
+                self.hits += 1
+                return entry[0], True
+            self.stale_hits += 1
+            return entry[0], False
+
+    def get(self, key, default=None):
+        value, fresh = self.get_entry(key)
+        return value if fresh else default
+
+    def __contains__(self, key):
+        return self.get_entry(key)[1]
+
+    def set(self, key, value, ttl=None):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def claim_refresh(self, key):
+        """True if no background refresh of key is running yet, claiming it for the caller"""
+        with self.lock:
+            if key in self.refreshing:
+                return None
+            self.refreshing.add(key)
+            return True
+
+    def release_refresh(self, key, token):
+        with self.lock:
+            self.refreshing.discard(key)
+
+    def dump(self):
+        """Entries with their remaining lifetime, since monotonic clocks don't survive a restart"""
+        now = time.monotonic()
+        with self.lock:
+            return [(key, value, expires_at - now) for key, (value, expires_at) in self.entries.items()
+                    if expires_at + self.max_stale >= now]
+
+    def restore(self, entries):
+        now = time.monotonic()
+        with self.lock:
+            for key, value, remaining in entries:
+                self.entries[key] = (value, now + remaining)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        return {"entries": len(self.entries), "hits": self.hits, "stale_hits": self.stale_hits, "misses": self.misses}
+
+class SharedCache:
+    """TTLCache-compatible cache stored in a state backend so replicas share entries"""
+
+    def __init__(self, backend, name, ttl, max_stale=0):
+        self.backend = backend
+        self.name = name
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    def _key(self, key):
+        return f"cache:{self.name}:{key!r}"
+
+    def get_entry(self, key):
+        """Return (value, fresh) for a servable entry, or (MISSING, False)"""
+        try:
+            entry = self.backend.get(self._key(key))
+        except Exception as e:
+            print(f"Shared cache {self.name} read failed: {e}")
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return MISSING, False
+        value, fresh_until = entry
+        if fresh_until >= time.time():
+            self.hits += 1
+            return value, True
+        self.stale_hits += 1
+        return value, False
+
+    def get(self, key, default=None):
+        value, fresh = self.get_entry(key)
+        return value if fresh else default
+
+    def __contains__(self, key):
+        return self.get_entry(key)[1]
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        try:
+            self.backend.set(self._key(key), (value, time.time() + ttl), ttl + self.max_stale)
+        except Exception as e:
+            print(f"Shared cache {self.name} write failed: {e}")
+
+    def delete(self, key):
+        self.backend.delete(self._key(key))
+
+    def claim_refresh(self, key):
+        """Single-flight token for refreshing key across every replica, or None if one is running"""
+        try:
+            return self.backend.acquire_lock(f"refresh:{self.name}:{key!r}", ttl=60)
+        except Exception as e:
+            print(f"Shared cache {self.name} lock failed: {e}")
+            return None
+
+    def release_refresh(self, key, token):
+        try:
+            self.backend.release_lock(f"refresh:{self.name}:{key!r}", token)
+        except Exception as e:
+            print(f"Shared cache {self.name} unlock failed: {e}")
+
+    def stats(self):
+        return {"backend": type(self.backend).__name__, "hits": self.hits, "stale_hits": self.stale_hits, "misses": self.misses}
+
+def make_cache(name, ttl, max_entries=10000, max_stale=0):
+    """A cache shared through the state backend when replicas share state, else a local TTLCache"""
+    if is_shared():
+        return SharedCache(state_backend, name, ttl, max_stale=max_stale)
+    return TTLCache(ttl, max_entries=max_entries, max_stale=max_stale)
+
+# Lookups that upstream definitively answered with "not found", keyed by (source, key)
+negative_cache = TTLCache(NEGATIVE_CACHE_TTL)
+
+def is_known_miss(source, key):
+    return (source, key) in negative_cache
+
+def remember_miss(source, key):
+    negative_cache.set((source, key), True)
+
+# Upstream metadata keyed by (source, key), and finished posts keyed by (command, anime, episode)
+metadata_cache = make_cache("metadata", METADATA_TTL, max_entries=5000, max_stale=METADATA_MAX_STALE)
+rendered_posts = make_cache("posts", POST_CACHE_TTL, max_entries=2000, max_stale=POST_MAX_STALE)
+
+# Posts recently sent to group chats, keyed like the post queue's dedup keys -> (message id, link)
+recent_posts = make_cache("recent_posts", RECENT_POST_WINDOW, max_entries=2000)
+
+refresh_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="swr-refresh")
+# A context variable rather than a thread-local, so executors that copy the context (see resolver) carry it along
+_in_refresh = ContextVar("in_background_refresh", default=False)
+
+def _load(cache, key, loader, should_cache):
+    value = loader()
+    if value is not None and (should_cache is None or should_cache(value)):
+        cache.set(key, value)
+    return value
+
+def _refresh(cache, key, loader, should_cache, token):
+    reset = _in_refresh.set(True)
+    try:
+        _load(cache, key, loader, should_cache)
+    except Exception as e:
+        print(f"Background refresh of {key} failed: {e}")
+    finally:
+        _in_refresh.reset(reset)
+        cache.release_refresh(key, token)
+
+def in_background_refresh():
+    """True while running a stale-while-revalidate refresh that no user is waiting on"""
+    return _in_refresh.get()
+
+def request_deadline(deadline):
+    """The caller's deadline, dropped for background refreshes so they can finish"""
+    return None if in_background_refresh() else deadline
+
+def swr_get(cache, key, loader, should_cache=None):
+    """Serve key from cache; stale entries are returned at once and refreshed in the background"""
+    value, fresh = cache.get_entry(key)
+    if value is MISSING:
+        return _load(cache, key, loader, should_cache)
+    if fresh:
+        return value
+    if in_background_refresh():
+        # A background refresh must not build on other stale entries
+        return _load(cache, key, loader, should_cache)
+    token = cache.claim_refresh(key)
+    if token is None:
+        return value
+    refresh_executor.submit(_refresh, cache, key, loader, should_cache, token)
+    return value
@@ -0,0 +1,150 @@
+import hashlib
+import json
+import os
+import pickle
+import sys
+import threading
+import time
+import zlib
+from collections import defaultdict
+from urllib.parse import urlsplit
+import requests
+from requests.structures import CaseInsensitiveDict
+from config import CASSETTE_MODE, CASSETTE_PATH, CASSETTE_LATENCY_SCALE, CASSETTE_MAX_BODY_BYTES
+
+# Response headers worth keeping; callers only look at the content type
+KEPT_HEADERS = ("content-type",)
+
+def request_key(method, url, kwargs):
+    """Identity of an upstream request: method, url and a digest of its params and body"""
+    body = json.dumps(
+        {"params": kwargs.get("params"), "json": kwargs.get("json"), "data": kwargs.get("data")},
+        sort_keys=True, default=str,
+    )
+    return method.upper(), url, hashlib.sha1(body.encode()).hexdigest()[:16]
+
+class Cassette:
+    """Records upstream exchanges with their timings to disk, or replays them instead of hitting the network"""
+
+    def __init__(self, mode=CASSETTE_MODE, path=CASSETTE_PATH, latency_scale=CASSETTE_LATENCY_SCALE):
+        self.mode = mode
+        self.path = path
+        self.latency_scale = latency_scale
+        self.lock = threading.Lock()
+        self.entries = defaultdict(list)  # request key -> recorded exchanges, in recording order
+        self.cursors = defaultdict(int)
+        self.recorded = 0
+        self.replayed = 0
+        self.misses = 0
+        self.size_only = 0  # streamed bodies recorded or replayed without their content
+        self._file = None
+        if mode == "replay":
+            self.load()
+        elif mode == "record":
+            print(f"Recording upstream requests to {path}")
+
+    def load(self):
+        for entry in read_cassette(self.path):
+            self.entries[entry["key"]].append(entry)
+        print(f"Replaying {sum(len(e) for e in self.entries.values())} upstream responses from {self.path}")
+
+    def record(self, method, url, kwargs, elapsed_ms, response=None, error=None, content=None, streamed=False):
+        """Append one exchange; streamed bodies are passed in as content, after the caller's own size checks"""
+        entry = {"key": request_key(method, url, kwargs), "elapsed_ms": round(elapsed_ms, 1), "at": time.time()}
+        if error is not None:
+            entry["error"] = type(error).__name__
+        else:
+            if content is None:
+                content = b"" if streamed else response.content
+            entry["status"] = response.status_code
+            entry["headers"] = {h: response.headers[h] for h in KEPT_HEADERS if h in response.headers}
+            if streamed and len(content) > CASSETTE_MAX_BODY_BYTES:
+                # Downloads over the limit keep only their size; replay serves that many zero bytes
+                entry["body_size"] = len(content)
+            else:
+                entry["body"] = zlib.compress(content, 6)
+        with self.lock:
+            if self._file is None:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                self._file = open(self.path, "ab")
+            pickle.dump(entry, self._file, protocol=pickle.HIGHEST_PROTOCOL)
+            self._file.flush()
+            self.recorded += 1
+            if "body_size" in entry:
+                self.size_only += 1
+
+    def replay(self, method, url, kwargs):
+        """Recorded response for the request after its (scaled) original latency; raises like the original call did"""
+        key = request_key(method, url, kwargs)
+        with self.lock:
+            recorded = self.entries.get(key)
+            if not recorded:
+                self.misses += 1
+                entry = None
+            else:
+                # Repeated requests get successive recordings, then keep getting the last one
+                entry = recorded[min(self.cursors[key], len(recorded) - 1)]
+                self.cursors[key] += 1
+                self.replayed += 1
+                if "body_size" in entry:
+                    self.size_only += 1
+        if entry is None:
+            raise requests.exceptions.ConnectionError(f"No cassette entry for {method} {url}")
+
+        delay = entry["elapsed_ms"] / 1000 * self.latency_scale
+        timeout = kwargs.get("timeout")
+        if isinstance(timeout, (int, float)) and delay > timeout:
+            # A response slower than this call's budget would have timed out
+            time.sleep(timeout)
+            raise requests.exceptions.Timeout(f"Replayed response for {url} took {delay:.2f}s")
+        time.sleep(delay)
+        if "error" in entry:
+            error = getattr(requests.exceptions, entry["error"], requests.exceptions.ConnectionError)
+            raise error(f"Replayed {entry['error']} for {url}")
+
+        response = requests.Response()
+        response.status_code = entry["status"]
+        response.headers = CaseInsensitiveDict(entry["headers"])
+        response.url = url
+        response._content = zlib.decompress(entry["body"]) if "body" in entry else bytes(entry["body_size"])
+        response._content_consumed = True
+        response.encoding = "utf-8"
+        return response
+
+    def stats(self):
+        return {
+            "mode": self.mode,
+            "path": self.path,
+            "recorded": self.recorded,
+            "replayed": self.replayed,
+            "misses": self.misses,
+            "size_only_bodies": self.size_only,
+            "max_body_bytes": CASSETTE_MAX_BODY_BYTES,
+            "latency_scale": self.latency_scale,
+        }
+
+def read_cassette(path):
+    """Recorded exchanges in file order"""
+    try:
+        with open(path, "rb") as f:
+            while True:
+                try:
+                    yield pickle.load(f)
+                except EOFError:
+                    return
+    except OSError as e:
+        print(f"Could not read cassette {path}: {e}")
+
+cassette = Cassette()
+
+if __name__ == "__main__":
+    # Summarize a cassette: requests, failures and latency per upstream host
+    hosts = defaultdict(list)
+    for entry in read_cassette(sys.argv[1] if len(sys.argv) > 1 else CASSETTE_PATH):
+        hosts[urlsplit(entry["key"][1]).hostname].append(entry)
+    for host, entries in sorted(hosts.items()):
+        times = sorted(e["elapsed_ms"] for e in entries)
+        errors = sum(1 for e in entries if "error" in e or e["status"] >= 400)
+        size = sum(len(e.get("body", b"")) for e in entries)
+        print(f"{host}: {len(entries)} requests, {errors} failed, "
+              f"p50 {times[len(times) // 2]:.0f}ms, max {times[-1]:.0f}ms, {size / 1024:.0f} KB stored")
@@ -0,0 +1,210 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from difflib import SequenceMatcher
+from config import CATALOG_TTL, ALIAS_INDEX_PATH
+
+# Words too common to be worth keeping in an abbreviation
+ABBREVIATION_STOPWORDS = {"the", "a", "an"}
+
+# Upstream searches are fuzzy; ignore title sets that don't resemble the catalog name
+MIN_TITLE_SIMILARITY = 0.6
+
+# Alias priorities: a real title beats an abbreviation that happens to collide
+PRIORITY_TITLE = 2
+PRIORITY_ABBREVIATION = 1
+
+def normalize_title(text):
+    """Lowercase, strip accents and punctuation so title variants compare equal"""
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKD", str(text))
+    text = "".join(ch for ch in text if not unicodedata.combining(ch)).lower()
+    text = re.sub(r"[^\w]+", " ", text)
+    return " ".join(text.split())
+
+def abbreviate(text):
+    """Initials of a multi-word title, e.g. 'Attack on Titan' -> 'aot'"""
+    words = normalize_title(text).split()
+    if len(words) < 2:
+        return ""
+    initials = "".join(w[0] for w in words if w not in ABBREVIATION_STOPWORDS or w == words[0])
+    return initials if len(initials) >= 2 else ""
+
+def catalog_id_for(name):
+    """Integer id derived from the lowercased catalog name, identical across restarts and replicas"""
+    return int.from_bytes(hashlib.blake2b(name.encode(), digest_size=6).digest(), "big")
+
+class Catalog:
+    """In-memory copy of the anime database with O(1) lookups by name"""
+
+    def __init__(self, ttl=CATALOG_TTL):
+        self.ttl = ttl
+        self.records = []
+        self.names = []
+        self.by_name = {}
+        self.by_id = {}     # compact integer id -> record
+        self.version = 0
+        self.loaded_at = 0
+        self.listeners = []
+
+    def is_fresh(self):
+        return bool(self.records) and time.time() - self.loaded_at < self.ttl
+
+    def load(self, data):
+        """Replace the catalog with freshly downloaded anime_data entries, notifying listeners on change"""
+        records = []
+        for anime in data:
+            if not anime.get("name"):
+                continue
+            poster_url = None
+            if anime.get('poster'):
+                posters = [p.strip() for p in anime['poster'].split(',')]
+                poster_url = posters[0] if posters else None
+            records.append({"name": anime["name"], "aid": anime.get("aid"), "poster": poster_url})
+        self.loaded_at = time.time()
+        if records == self.records:
+            return
+        self._set_records(records)
+        self.version += 1
+        for listener in self.listeners:
+            try:
+                listener(self)
+            except Exception as e:
+                print(f"Catalog listener error: {e}")
+
+    def _set_records(self, records):
+        self.records = records
+        self.names = [r["name"] for r in records]
+        self.by_name = {r["name"].lower(): r for r in records}
+        by_id = {}
+        for name, record in self.by_name.items():
+            catalog_id = catalog_id_for(name)
+            if catalog_id in by_id:
+                print(f"Catalog id collision between '{by_id[catalog_id]['name']}' and '{record['name']}'")
+                continue
+            by_id[catalog_id] = record
+        self.by_id = by_id
+
+    def dump(self):
+        return {"records": self.records, "loaded_at": self.loaded_at, "version": self.version}
+
+    def restore(self, state):
+        self._set_records(state["records"])
+        self.loaded_at = state["loaded_at"]
+        self.version = state["version"]
+
+    def id_for(self, record):
+        """Compact integer id of a catalog record, small enough for callback data"""
+        catalog_id = catalog_id_for(record["name"].lower())
+        return catalog_id if self.by_id.get(catalog_id) is record else None
+
+    def get_by_id(self, catalog_id):
+        return self.by_id.get(catalog_id)
+
+    def get(self, anime_name):
+        """Exact (case-insensitive) catalog record for anime_name"""
+        if not anime_name:
+            return None
+        return self.by_name.get(anime_name.lower())
+
+class AliasIndex:
+    """Persistent map of normalized alternate titles and abbreviations to catalog names"""
+
+    def __init__(self, path=ALIAS_INDEX_PATH):
+        self.path = path
+        self.aliases = {}   # normalized alias -> [catalog name or None if ambiguous, priority]
+        self.sourced = set()  # catalog names whose upstream titles have been indexed
+        self.attempted = set()  # catalog names already looked up by the background crawl, indexed or not
+        self.lock = threading.Lock()
+        self.dirty = False
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            self.aliases = data.get("aliases", {})
+            self.sourced = set(data.get("sourced", []))
+            self.attempted = set(data.get("attempted", []))
+            print(f"Loaded {len(self.aliases)} anime aliases")
+        except (OSError, ValueError):
+            pass
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            # Copied under the lock: render threads keep adding titles while the file is written
+            data = {"aliases": dict(self.aliases), "sourced": sorted(self.sourced), "attempted": sorted(self.attempted)}
+            self.dirty = False
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path + ".tmp", "w") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(self.path + ".tmp", self.path)
+        except OSError as e:
+            print(f"Failed to save alias index: {e}")
+            with self.lock:
+                self.dirty = True
+
+    def _add(self, alias, anime_name, priority):
+        if not alias:
+            return
+        current = self.aliases.get(alias)
+        if current is None or priority > current[1]:
+            self.aliases[alias] = [anime_name, priority]
+            self.dirty = True
+        elif priority == current[1] and current[0] not in (anime_name, None):
+            # Two shows share this alias; refuse to guess
+            self.aliases[alias] = [None, priority]
+            self.dirty = True
+
+    def add_titles(self, anime_name, titles, sourced=True):
+        """Index every title variant (and its abbreviation) for a catalog anime"""
+        titles = [t for t in titles if t]
+        target = normalize_title(anime_name)
+        if not any(SequenceMatcher(None, target, normalize_title(t)).ratio() >= MIN_TITLE_SIMILARITY for t in titles):
+            return
+        with self.lock:
+            for title in titles:
+                self._add(normalize_title(title), anime_name, PRIORITY_TITLE)
+                self._add(abbreviate(title), anime_name, PRIORITY_ABBREVIATION)
+            if sourced and anime_name not in self.sourced:
+                self.sourced.add(anime_name)
+                self.dirty = True
+
+    def mark_attempted(self, anime_name):
+        with self.lock:
+            if anime_name not in self.attempted:
+                self.attempted.add(anime_name)
+                self.dirty = True
+
+    def needs_titles(self, anime_name):
+        """Whether the crawl has yet to look this anime up upstream"""
+        return anime_name not in self.sourced and anime_name not in self.attempted
+
+    def index_catalog(self, catalog):
+        """Seed aliases from the catalog names themselves"""
+        for name in catalog.names:
+            self.add_titles(name, [name], sourced=False)
+
+    def lookup(self, query):
+        entry = self.aliases.get(normalize_title(query))
+        return entry[0] if entry else None
+
+def match_anime(query):
+    """Resolve user input to a catalog record via exact name, then the alias index"""
+    record = catalog.get(query)
+    if record:
+        return record
+    name = alias_index.lookup(query)
+    return catalog.get(name) if name else None
+
+catalog = Catalog()
+alias_index = AliasIndex()
+alias_index.load()
+catalog.listeners.append(alias_index.index_catalog)
@@ -5,3 +5,80 @@ APP_URL = os.getenv("APP_URL", "https://aniflixofficials.koyeb.app")
 BOT_TOKEN = os.getenv("BOT_TOKEN", "")
 API_ID = os.getenv("API_ID", "")
 API_HASH = os.getenv("API_HASH", "")
+
+# Post generation queue
+POST_WORKERS = int(os.getenv("POST_WORKERS", "4"))
+POST_QUEUE_LIMIT = int(os.getenv("POST_QUEUE_LIMIT", "100"))
+POST_QUEUE_PER_CHAT = int(os.getenv("POST_QUEUE_PER_CHAT", "5"))
+
+# Suggestion scoring offload
+SCORING_PROCESSES = int(os.getenv("SCORING_PROCESSES", str(min(4, os.cpu_count() or 1))))
+SCORING_THRESHOLD = int(os.getenv("SCORING_THRESHOLD", "2000"))
+
+# Local state and image pipeline
+DATA_DIR = os.getenv("DATA_DIR", "data")
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", os.path.join(DATA_DIR, "images"))
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+IMAGE_MAX_DIMENSION = int(os.getenv("IMAGE_MAX_DIMENSION", "1280"))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "82"))
+IMAGE_MAX_DOWNLOAD_BYTES = int(os.getenv("IMAGE_MAX_DOWNLOAD_BYTES", str(20 * 1024 * 1024)))
+
+# Anime catalog and alias index
+CATALOG_TTL = int(os.getenv("CATALOG_TTL", "600"))
+ALIAS_INDEX_PATH = os.getenv("ALIAS_INDEX_PATH", os.path.join(DATA_DIR, "aliases.json"))
+# Seconds between AniList lookups when crawling titles for the whole catalog; 0 (default) disables the crawl
+ALIAS_BUILD_INTERVAL = float(os.getenv("ALIAS_BUILD_INTERVAL", "0"))
+# Seconds between saves of newly learned aliases to disk
+ALIAS_SAVE_INTERVAL = int(os.getenv("ALIAS_SAVE_INTERVAL", "60"))
+
+# Caching
+NEGATIVE_CACHE_TTL = int(os.getenv("NEGATIVE_CACHE_TTL", "300"))
+METADATA_TTL = int(os.getenv("METADATA_TTL", "3600"))
+METADATA_MAX_STALE = int(os.getenv("METADATA_MAX_STALE", "21600"))
+POST_CACHE_TTL = int(os.getenv("POST_CACHE_TTL", "900"))
+POST_MAX_STALE = int(os.getenv("POST_MAX_STALE", "3600"))
+
+# Pooled upstream HTTP clients
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "8"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "true").lower() == "true"
+HTTP2_HOSTS = os.getenv("HTTP2_HOSTS", "kitsu.io,graphql.anilist.co,api.ani.zip,raw.githubusercontent.com").split(",")
+
+# Kitsu episode index
+KITSU_INDEX_REFRESH = int(os.getenv("KITSU_INDEX_REFRESH", "1800"))
+KITSU_INDEX_MAX_PAGES = int(os.getenv("KITSU_INDEX_MAX_PAGES", "100"))
+
+# Hedged upstream requests
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "true").lower() == "true"
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_MIN_DELAY_MS = int(os.getenv("HEDGE_MIN_DELAY_MS", "100"))
+LATENCY_WINDOW = int(os.getenv("LATENCY_WINDOW", "200"))
+
+# End-to-end time budget for building and sending one post, in seconds
+POST_DEADLINE = float(os.getenv("POST_DEADLINE", "8"))
+
+# Repeat requests for a post sent to the same group within this many seconds get a link to it instead
+RECENT_POST_WINDOW = int(os.getenv("RECENT_POST_WINDOW", "120"))
+
+# Warm-state snapshots
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH", os.path.join(DATA_DIR, "warm_state.snap"))
+SNAPSHOT_INTERVAL = int(os.getenv("SNAPSHOT_INTERVAL", "300"))
+SNAPSHOT_COMPRESS = os.getenv("SNAPSHOT_COMPRESS", "true").lower() == "true"
+
+# Where sessions, caches and single-flight locks live: "memory" (this process) or "redis" (shared by replicas)
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory").lower()
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+STATE_KEY_PREFIX = os.getenv("STATE_KEY_PREFIX", "aniflix:")
+SESSION_TTL = int(os.getenv("SESSION_TTL", "3600"))
+
+# Memory profiling: tracemalloc from boot when enabled (admins can also toggle it with /memory)
+MEMORY_PROFILING = os.getenv("MEMORY_PROFILING", "false").lower() == "true"
+MEMORY_TRACE_FRAMES = int(os.getenv("MEMORY_TRACE_FRAMES", "10"))
+ADMIN_IDS = [int(i) for i in os.getenv("ADMIN_IDS", "").replace(",", " ").split()]
+
+# Upstream cassettes: "record" saves every upstream exchange with its timing, "replay" serves them offline
+CASSETTE_MODE = os.getenv("CASSETTE_MODE", "off").lower()
+CASSETTE_PATH = os.getenv("CASSETTE_PATH", os.path.join(DATA_DIR, "upstream.cassette"))
+CASSETTE_LATENCY_SCALE = float(os.getenv("CASSETTE_LATENCY_SCALE", "1.0"))
+# Streamed downloads larger than this are recorded by size only and replay as zero bytes, which images
+# can't decode; the default keeps every image the bot would accept so replays take the production path
+CASSETTE_MAX_BODY_BYTES = int(os.getenv("CASSETTE_MAX_BODY_BYTES", str(IMAGE_MAX_DOWNLOAD_BYTES)))
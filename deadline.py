@@ -0,0 +1,25 @@
+import time
+
+class Deadline:
+    """Absolute time budget for one post, shared by every stage that works on it"""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def timeout(self, default):
+        """Timeout for one stage: its usual timeout, capped by what is left of the budget"""
+        return min(default, self.remaining())
+
+def stage_timeout(deadline, default):
+    """Timeout for a stage, or None when the budget is already spent"""
+    if deadline is None:
+        return default
+    timeout = deadline.timeout(default)
+    return timeout if timeout > 0.05 else None
@@ -0,0 +1,87 @@
+import asyncio
+import functools
+import json
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+# Probes and curl never need more than this to send a request line and headers
+REQUEST_TIMEOUT = 10
+MAX_HEADER_LINES = 100
+
+# Probes get their own threads so they keep answering while every render worker is busy
+probe_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="health-probe")
+
+async def run_probe(func, *args):
+    """Run a blocking check on the probe pool and await its result"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(probe_executor, functools.partial(func, *args))
+
+# Public debug routes get one thread of their own, so hammering them can't starve the probes
+debug_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="health-debug")
+
+async def run_debug(func, *args):
+    """Run a blocking debug report on its own thread and await its result"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(debug_executor, functools.partial(func, *args))
+
+def json_response(payload, status=200):
+    return status, "application/json", json.dumps(payload, default=str).encode()
+
+def text_response(text, status=200, content_type="text/html"):
+    return status, content_type, text.encode()
+
+class HealthServer:
+    """Minimal HTTP/1.1 server on the bot's event loop for health probes and debug routes"""
+
+    def __init__(self, routes, host=None, port=10000):
+        self.routes = routes  # path -> async handler returning (status, content_type, body); "*" matches any path
+        self.host = host
+        self.port = port
+        self.server = None
+        self.requests = 0
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+
+    async def close(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+
+    async def _read_request(self, reader):
+        request_line = await reader.readline()
+        for _ in range(MAX_HEADER_LINES):
+            if (await reader.readline()) in (b"\r\n", b"\n", b""):
+                break
+        parts = request_line.decode("latin-1").split()
+        return (parts[0].upper(), parts[1].split("?", 1)[0]) if len(parts) >= 2 else (None, None)
+
+    async def _handle(self, reader, writer):
+        try:
+            method, path = await asyncio.wait_for(self._read_request(reader), REQUEST_TIMEOUT)
+            if method is None:
+                return
+            self.requests += 1
+            handler = self.routes.get(path) or self.routes.get("*")
+            if method not in ("GET", "HEAD"):
+                status, content_type, body = text_response("Method not allowed", 405, "text/plain")
+            elif handler is None:
+                status, content_type, body = text_response("Not found", 404, "text/plain")
+            else:
+                try:
+                    status, content_type, body = await handler()
+                except Exception as e:
+                    print(f"Health route {path} failed: {e}")
+                    status, content_type, body = text_response("Internal error", 500, "text/plain")
+            head = (
+                f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n"
+            ).encode()
+            writer.write(head if method == "HEAD" else head + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
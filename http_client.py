@@ -0,0 +1,161 @@
+import threading
+import time
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from config import HTTP_POOL_SIZE, HTTP2_ENABLED, HTTP2_HOSTS
+from cassette import cassette
+
+try:
+    import httpx
+    import h2  # noqa: F401 - httpx only negotiates HTTP/2 when h2 is installed
+except ImportError:
+    httpx = None
+
+HTTP_ERRORS = (requests.exceptions.RequestException,) + ((httpx.HTTPError,) if httpx else ())
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+class HostClient:
+    """Keep-alive connection pool for a single upstream host, with usage counters"""
+
+    def __init__(self, host):
+        self.host = host
+        self.http2 = bool(httpx) and HTTP2_ENABLED and host in HTTP2_HOSTS
+        if self.http2:
+            self.client = httpx.Client(
+                http2=True,
+                headers={'User-Agent': USER_AGENT},
+                limits=httpx.Limits(max_connections=HTTP_POOL_SIZE, max_keepalive_connections=HTTP_POOL_SIZE),
+                follow_redirects=True
+            )
+        else:
+            self.client = requests.Session()
+            self.client.headers['User-Agent'] = USER_AGENT
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE, pool_block=True)
+            self.client.mount("https://", adapter)
+            self.client.mount("http://", adapter)
+            self.adapter = adapter
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.total_ms = 0.0
+
+    def request(self, method, url, **kwargs):
+        start = time.perf_counter()
+        try:
+            if cassette.mode == "replay":
+                return cassette.replay(method, url, kwargs)
+            # Streamed bodies are recorded by the caller once it has read (and size-checked) them
+            streamed = kwargs.get("stream", False)
+            if self.http2:
+                kwargs.pop("stream", None)
+            if self.http2 and streamed:
+                # httpx streams through send(); the caller reads the body and closes the response
+                response = self.client.send(self.client.build_request(method, url, **kwargs), stream=True)
+            else:
+                response = self.client.request(method, url, **kwargs)
+            if cassette.mode == "record" and not streamed:
+                cassette.record(method, url, kwargs, (time.perf_counter() - start) * 1000, response=response)
+        except Exception as e:
+            with self.lock:
+                self.errors += 1
+            if cassette.mode == "record" and isinstance(e, HTTP_ERRORS):
+                cassette.record(method, url, kwargs, (time.perf_counter() - start) * 1000, error=e)
+            raise
+        finally:
+            with self.lock:
+                self.requests += 1
+                self.total_ms += (time.perf_counter() - start) * 1000
+        return response
+
+    def connections_opened(self):
+        """New TCP/TLS connections made so far (requests backend only)"""
+        if self.http2:
+            return None
+        pools = self.adapter.poolmanager.pools
+        return sum(pools[key].num_connections for key in list(pools.keys()))
+
+    def stats(self):
+        with self.lock:
+            return {
+                "protocol": "h2" if self.http2 else "http/1.1",
+                "requests": self.requests,
+                "errors": self.errors,
+                "connections_opened": self.connections_opened(),
+                "avg_ms": round(self.total_ms / self.requests, 1) if self.requests else 0,
+            }
+
+    def close(self):
+        self.client.close()
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def client_for(url):
+    """Shared pooled client for the url's host"""
+    host = urlsplit(url).hostname or ""
+    client = _clients.get(host)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(host)
+            if client is None:
+                client = _clients[host] = HostClient(host)
+    return client
+
+def http_get(url, timeout=10, **kwargs):
+    return client_for(url).request("GET", url, timeout=timeout, **kwargs)
+
+def http_post(url, timeout=10, **kwargs):
+    return client_for(url).request("POST", url, timeout=timeout, **kwargs)
+
+def http_head(url, timeout=5, **kwargs):
+    client = client_for(url)
+    kwargs.setdefault("follow_redirects" if client.http2 else "allow_redirects", True)
+    return client.request("HEAD", url, timeout=timeout, **kwargs)
+
+def ping_url(url, timeout=10):
+    """Plain GET outside the upstream pools and the cassette, for the bot's own health URL"""
+    return requests.get(url, timeout=timeout)
+
+def http_download(url, max_bytes, timeout=10):
+    """GET a body of at most max_bytes; returns (status, content_type, content or None if too large)"""
+    client = client_for(url)
+    start = time.perf_counter()
+    status, content_type, content, read = _download(client, url, max_bytes, timeout)
+    if cassette.mode == "record":
+        cassette.record("GET", url, {"timeout": timeout}, (time.perf_counter() - start) * 1000,
+                        response=read[0], content=read[1], streamed=True)
+    return status, content_type, content
+
+def _download(client, url, max_bytes, timeout):
+    """(status, content_type, content or None, (response, bytes read)) for http_download"""
+    response = client.request("GET", url, timeout=timeout, stream=True)
+    try:
+        content_type = response.headers.get('content-type', '')
+        if response.status_code != 200:
+            return response.status_code, content_type, None, (response, b"")
+        # httpx and requests name their streaming iterators differently
+        chunk_iter = response.iter_bytes if hasattr(response, "iter_bytes") else response.iter_content
+        chunks = []
+        size = 0
+        for chunk in chunk_iter(64 * 1024):
+            size += len(chunk)
+            chunks.append(chunk)
+            if size > max_bytes:
+                # Stop reading; the partial body is only kept for its size
+                return response.status_code, content_type, None, (response, b"".join(chunks))
+        data = b"".join(chunks)
+        return response.status_code, content_type, data, (response, data)
+    finally:
+        response.close()
+
+def pool_stats():
+    """Per-host request, error, latency and connection counters"""
+    return {host: client.stats() for host, client in list(_clients.items())}
+
+def close_all():
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
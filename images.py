@@ -0,0 +1,180 @@
+import hashlib
+import io
+import json
+import os
+import threading
+from http_client import http_download
+from deadline import stage_timeout
+from config import (IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_BYTES, IMAGE_MAX_DIMENSION,
+                    IMAGE_JPEG_QUALITY, IMAGE_MAX_DOWNLOAD_BYTES)
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Telegram rejects uploaded photos above 10 MB
+TELEGRAM_PHOTO_LIMIT = 10 * 1024 * 1024
+
+_lock = threading.Lock()
+_index_path = os.path.join(IMAGE_CACHE_DIR, "index.json")
+_index = None  # {"urls": {url: digest}, "sizes": {digest: bytes}, "file_ids": {digest: file_id}, "original_sizes": {url: bytes}}
+image_stats = {"posts": 0, "original_bytes": 0, "sent_bytes": 0, "file_id_hits": 0, "cache_hits": 0, "evictions": 0}
+
+class PreparedImage:
+    """A post image stored in the local cache, ready to upload or resend by file_id"""
+
+    def __init__(self, digest, path, original_size, size, file_id=None):
+        self.digest = digest
+        self.path = path
+        self.original_size = original_size
+        self.size = size
+        self.file_id = file_id
+
+def _load_index():
+    global _index
+    if _index is None:
+        try:
+            with open(_index_path) as f:
+                _index = json.load(f)
+        except (OSError, ValueError):
+            _index = {"urls": {}, "file_ids": {}, "sizes": {}}
+        # Indexes written before original sizes were kept
+        _index.setdefault("original_sizes", {})
+    return _index
+
+def _save_index():
+    os.makedirs(IMAGE_CACHE_DIR, exist_ok=True)
+    tmp_path = _index_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(_index, f)
+    os.replace(tmp_path, _index_path)
+
+def _blob_path(digest):
+    return os.path.join(IMAGE_CACHE_DIR, digest[:2], f"{digest}.jpg")
+
+def download_image(url, timeout=10):
+    """Download an image, refusing anything that is not an image or is too large"""
+    status, content_type, data = http_download(url, IMAGE_MAX_DOWNLOAD_BYTES, timeout=timeout)
+    if status != 200 or 'image' not in content_type.lower():
+        return None
+    if data is None:
+        print(f"Image too large to download: {url}")
+    return data
+
+def recompress_image(data):
+    """Downscale and re-encode an image as a Telegram-friendly JPEG"""
+    if Image is None:
+        # Without Pillow the original is only usable if Telegram will accept it
+        return data if len(data) <= TELEGRAM_PHOTO_LIMIT else None
+    with Image.open(io.BytesIO(data)) as img:
+        img.thumbnail((IMAGE_MAX_DIMENSION, IMAGE_MAX_DIMENSION))
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        out = io.BytesIO()
+        img.save(out, "JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True, progressive=True)
+    result = out.getvalue()
+    # Small originals can already be tighter than a re-encode
+    if len(result) >= len(data) and data[:3] == b"\xff\xd8\xff":
+        return data
+    return result
+
+def _evict(index):
+    """Drop least recently used images until the cache fits its byte budget"""
+    entries = []
+    total = 0
+    for digest, size in index["sizes"].items():
+        path = _blob_path(digest)
+        try:
+            entries.append((os.path.getmtime(path), digest, size))
+            total += size
+        except OSError:
+            entries.append((0, digest, 0))
+    entries.sort()
+    for _, digest, size in entries:
+        if total <= IMAGE_CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(_blob_path(digest))
+        except OSError:
+            pass
+        total -= size
+        del index["sizes"][digest]
+        index["file_ids"].pop(digest, None)
+        image_stats["evictions"] += 1
+    live = set(index["sizes"])
+    index["urls"] = {u: d for u, d in index["urls"].items() if d in live}
+    index["original_sizes"] = {u: n for u, n in index["original_sizes"].items() if u in index["urls"]}
+
+def prepare_image(url, deadline=None):
+    """Fetch, shrink and cache the image at url once; returns a PreparedImage or None"""
+    if not url:
+        return None
+    with _lock:
+        index = _load_index()
+        digest = index["urls"].get(url)
+        if digest and os.path.exists(_blob_path(digest)):
+            path = _blob_path(digest)
+            os.utime(path)
+            image_stats["cache_hits"] += 1
+            size = index["sizes"].get(digest, 0)
+            original_size = index["original_sizes"].get(url, size)
+            return PreparedImage(digest, path, original_size, size, index["file_ids"].get(digest))
+    timeout = stage_timeout(deadline, 10)
+    if timeout is None:
+        return None
+    try:
+        data = download_image(url, timeout)
+        if not data:
+            return None
+        processed = recompress_image(data)
+        if not processed:
+            return None
+    except Exception as e:
+        print(f"Image pipeline error for {url}: {e}")
+        return None
+    digest = hashlib.sha256(processed).hexdigest()
+    path = _blob_path(digest)
+    with _lock:
+        index = _load_index()
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + ".tmp", "wb") as f:
+                f.write(processed)
+            os.replace(path + ".tmp", path)
+        index["urls"][url] = digest
+        index["sizes"][digest] = len(processed)
+        index["original_sizes"][url] = len(data)
+        _evict(index)
+        _save_index()
+        return PreparedImage(digest, path, len(data), len(processed), index["file_ids"].get(digest))
+
+def remember_file_id(prepared, file_id):
+    """Store the Telegram file_id for an uploaded image so it is never uploaded twice"""
+    with _lock:
+        index = _load_index()
+        if prepared.digest in index["sizes"]:
+            index["file_ids"][prepared.digest] = file_id
+            _save_index()
+
+def forget_file_id(prepared):
+    with _lock:
+        index = _load_index()
+        if index["file_ids"].pop(prepared.digest, None):
+            _save_index()
+    prepared.file_id = None
+
+def record_sent(prepared):
+    """Account the bytes a post actually pushed to Telegram"""
+    image_stats["posts"] += 1
+    image_stats["original_bytes"] += prepared.original_size
+    if prepared.file_id:
+        image_stats["file_id_hits"] += 1
+    else:
+        image_stats["sent_bytes"] += prepared.size
+
+def index_counts():
+    """Entry counts of the on-disk image index"""
+    with _lock:
+        index = _load_index()
+        return {"urls": len(index["urls"]), "files": len(index["sizes"]), "file_ids": len(index["file_ids"])}
@@ -0,0 +1,106 @@
+import asyncio
+import functools
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from config import POST_WORKERS, POST_QUEUE_LIMIT, POST_QUEUE_PER_CHAT
+
+# Blocking upstream calls run here instead of on the pyrogram event loop
+render_executor = ThreadPoolExecutor(max_workers=POST_WORKERS, thread_name_prefix="post-render")
+
+async def run_blocking(func, *args):
+    """Run a blocking helper on the render pool and await its result"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(render_executor, functools.partial(func, *args))
+
+class PostQueue:
+    """Bounded post queue with per-chat round-robin fairness and duplicate collapsing"""
+
+    def __init__(self, workers=POST_WORKERS, limit=POST_QUEUE_LIMIT, per_chat=POST_QUEUE_PER_CHAT):
+        self.workers = workers
+        self.limit = limit
+        self.per_chat = per_chat
+        self.pending = OrderedDict()  # chat_id -> deque of (key, job factory), in serving order
+        self.keys = set()             # dedup keys of queued and running jobs
+        self.queued = 0
+        self.active = 0
+        self._signal = None
+        self._tasks = []
+
+    def _start(self):
+        if self._tasks:
+            return
+        self._signal = asyncio.Semaphore(0)
+        for _ in range(self.workers):
+            self._tasks.append(asyncio.get_running_loop().create_task(self._worker()))
+
+    def position(self, chat_id, key):
+        """1-based position of a queued job in round-robin serving order, 0 if not queued"""
+        jobs = self.pending.get(chat_id)
+        if not jobs:
+            return 0
+        index = next((i for i, (k, _) in enumerate(jobs) if k == key), None)
+        if index is None:
+            return 0
+        ahead = 0
+        for other_chat, other_jobs in self.pending.items():
+            if other_chat == chat_id:
+                ahead += index
+                break
+            ahead += min(len(other_jobs), index + 1)
+        for other_chat, other_jobs in reversed(self.pending.items()):
+            if other_chat == chat_id:
+                break
+            ahead += min(len(other_jobs), index)
+        return ahead + 1
+
+    def submit(self, chat_id, key, job):
+        """Queue a job factory; returns (status, position) where status is started/queued/duplicate/full"""
+        self._start()
+        if key in self.keys:
+            return "duplicate", self.position(chat_id, key)
+        jobs = self.pending.get(chat_id)
+        if self.queued >= self.limit or (jobs and len(jobs) >= self.per_chat):
+            return "full", 0
+        if jobs is None:
+            jobs = self.pending[chat_id] = deque()
+        jobs.append((key, job))
+        self.keys.add(key)
+        self.queued += 1
+        saturated = self.active + self.queued > self.workers
+        self._signal.release()
+        if saturated:
+            return "queued", self.position(chat_id, key)
+        return "started", 0
+
+    def _pop(self):
+        chat_id, jobs = next(iter(self.pending.items()))
+        key, job = jobs.popleft()
+        if jobs:
+            self.pending.move_to_end(chat_id)
+        else:
+            del self.pending[chat_id]
+        self.queued -= 1
+        return key, job
+
+    async def _worker(self):
+        while True:
+            await self._signal.acquire()
+            key, job = self._pop()
+            self.active += 1
+            try:
+                await job()
+            except Exception as e:
+                print(f"Post job {key} failed: {e}")
+            finally:
+                self.active -= 1
+                self.keys.discard(key)
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "active": self.active,
+            "queued": self.queued,
+            "chats_waiting": len(self.pending),
+        }
+
+post_queue = PostQueue()
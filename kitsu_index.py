@@ -0,0 +1,166 @@
+import threading
+import time
+from config import KITSU_INDEX_REFRESH, KITSU_INDEX_MAX_PAGES
+
+# Kitsu caps episode pages at 20 records
+KITSU_PAGE_LIMIT = 20
+# Page time assumed until one has been measured
+DEFAULT_PAGE_MS = 1000
+
+class KitsuIndex:
+    """Kitsu ids per catalog anime and a compact episode number -> (thumbnail, synopsis) table per Kitsu anime"""
+
+    def __init__(self, api_url, fetch_json, refresh_interval=KITSU_INDEX_REFRESH, max_pages=KITSU_INDEX_MAX_PAGES):
+        self.api_url = api_url
+        self.fetch_json = fetch_json
+        self.refresh_interval = refresh_interval
+        self.max_pages = max_pages
+        self.anime_ids = {}  # catalog aid (or name) -> (kitsu id, poster url)
+        self.episodes = {}   # kitsu id -> {"table": {number: (thumb, synopsis)}, "count": records paged, "paged": highest number paged, "checked_at": t}
+        self.locks = {}
+        self.lock = threading.Lock()
+        self.page_ms = None  # moving average of one episode page fetch
+        self.filling = set()  # kitsu ids being paged in the background
+
+    def _lock_for(self, kitsu_id):
+        with self.lock:
+            return self.locks.setdefault(kitsu_id, threading.Lock())
+
+    def remember_anime(self, catalog_key, kitsu_id, poster_url):
+        self.anime_ids[catalog_key] = (kitsu_id, poster_url)
+
+    def lookup_anime(self, catalog_key):
+        return self.anime_ids.get(catalog_key)
+
+    @staticmethod
+    def _row(attrs):
+        thumb = attrs.get('thumbnail') or {}
+        return thumb.get('original'), attrs.get('synopsis')
+
+    def _affordable_pages(self, deadline):
+        """Pages worth fetching inline: half the remaining budget, the rest is for the other sources"""
+        if deadline is None:
+            return self.max_pages
+        page_seconds = (self.page_ms or DEFAULT_PAGE_MS) / 1000
+        return min(self.max_pages, int(deadline.remaining() / 2 / page_seconds))
+
+    def _fetch_one(self, kitsu_id, episode_number, deadline=None):
+        """(thumbnail, synopsis) for a single episode, or None when Kitsu doesn't have it"""
+        data = self.fetch_json(
+            f"{self.api_url}/anime/{kitsu_id}/episodes?filter[number]={episode_number}"
+            f"&fields[episodes]=number,thumbnail,synopsis",
+            deadline,
+        )
+        if not data or not data.get('data'):
+            return None
+        return self._row(data['data'][0].get('attributes', {}))
+
+    def _fill(self, kitsu_id):
+        """Page an anime's episodes off the post path, then merge them into the published entry"""
+        try:
+            with self._lock_for(kitsu_id):
+                base = self.episodes.get(kitsu_id) or {"table": {}, "count": 0, "paged": 0, "checked_at": 0}
+            entry = dict(base, table=dict(base["table"]))
+            complete = self._page_episodes(kitsu_id, entry)
+            with self._lock_for(kitsu_id):
+                current = self.episodes.get(kitsu_id, entry)
+                table = dict(entry["table"])
+                table.update(current["table"])
+                self.episodes[kitsu_id] = {
+                    "table": table,
+                    "count": max(entry["count"], current["count"]),
+                    "paged": max(entry.get("paged", 0), current.get("paged", 0)),
+                    "checked_at": time.time() if complete else current["checked_at"],
+                }
+        except Exception as e:
+            print(f"Background Kitsu paging for {kitsu_id} failed: {e}")
+        finally:
+            with self.lock:
+                self.filling.discard(kitsu_id)
+
+    def _fill_later(self, kitsu_id):
+        with self.lock:
+            if kitsu_id in self.filling:
+                return
+            self.filling.add(kitsu_id)
+        threading.Thread(target=self._fill, args=(kitsu_id,), daemon=True).start()
+
+    def _page_episodes(self, kitsu_id, entry, deadline=None, until=None):
+        """Fetch episode pages after the ones already indexed; True once the last page has been seen"""
+        url = (
+            f"{self.api_url}/anime/{kitsu_id}/episodes?sort=number"
+            f"&fields[episodes]=number,thumbnail,synopsis"
+            f"&page[limit]={KITSU_PAGE_LIMIT}&page[offset]={entry['count']}"
+        )
+        for _ in range(self.max_pages):
+            if deadline and deadline.expired():
+                return False
+            start = time.perf_counter()
+            data = self.fetch_json(url, deadline)
+            ms = (time.perf_counter() - start) * 1000
+            self.page_ms = ms if self.page_ms is None else self.page_ms * 0.8 + ms * 0.2
+            if not data or 'data' not in data:
+                return False
+            for record in data['data']:
+                attrs = record.get('attributes', {})
+                number = attrs.get('number')
+                if number is None:
+                    continue
+                entry["table"][int(number)] = self._row(attrs)
+                entry["paged"] = max(entry.get("paged", 0), int(number))
+            entry["count"] += len(data['data'])
+            url = (data.get('links') or {}).get('next')
+            if not url or not data['data']:
+                break
+            if until is not None and entry.get("paged", 0) >= until:
+                # Enough for this request; later ones carry on from here
+                return False
+        return True
+
+    def get_episode(self, kitsu_id, episode_number, deadline=None):
+        """(thumbnail, synopsis) for an episode, paging Kitsu only for episodes not indexed yet"""
+        episode_number = int(episode_number)
+        entry = self.episodes.get(kitsu_id)
+        if entry and episode_number in entry["table"]:
+            return entry["table"][episode_number]
+        with self._lock_for(kitsu_id):
+            entry = self.episodes.get(kitsu_id)
+            if entry is None:
+                entry = {"table": {}, "count": 0, "paged": 0, "checked_at": 0}
+            elif episode_number in entry["table"]:
+                return entry["table"][episode_number]
+            # Gaps below the last paged episode are real gaps; newer ones may have aired since we looked.
+            # Single episodes fetched directly don't count, the pages before them haven't been seen yet
+            last_known = entry.get("paged", max(entry["table"], default=0))
+            stale = time.time() - entry["checked_at"] > self.refresh_interval
+            if episode_number > last_known and (stale or not entry["checked_at"]):
+                pages = (episode_number - entry["count"]) // KITSU_PAGE_LIMIT + 1
+                if pages > self._affordable_pages(deadline):
+                    # Too far to page within the budget: fetch just this episode and index the rest in the background
+                    row = self._fetch_one(kitsu_id, episode_number, deadline)
+                    if row:
+                        table = dict(entry["table"])
+                        table[episode_number] = row
+                        self.episodes[kitsu_id] = dict(entry, table=table)
+                    self._fill_later(kitsu_id)
+                    return row or (None, None)
+                # Page into a copy and publish it whole: published entries are never changed, so dump needs no locks
+                entry = dict(entry, table=dict(entry["table"]))
+                if self._page_episodes(kitsu_id, entry, deadline, until=episode_number):
+                    entry["checked_at"] = time.time()
+                self.episodes[kitsu_id] = entry
+        return entry["table"].get(episode_number, (None, None))
+
+    def dump(self):
+        return {"anime_ids": dict(self.anime_ids), "episodes": dict(self.episodes)}
+
+    def restore(self, state):
+        self.anime_ids.update(state.get("anime_ids", {}))
+        self.episodes.update(state.get("episodes", {}))
+
+    def stats(self):
+        return {
+            "anime_ids": len(self.anime_ids),
+            "anime_indexed": len(self.episodes),
+            "episodes": sum(len(e["table"]) for e in list(self.episodes.values())),
+        }
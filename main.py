@@ -0,0 +1,5 @@
+# Entry point. Scoring workers are spawned processes that re-run the main module,
+# so bot.py (Telegram client, caches, state backend) is only imported when run directly.
+if __name__ == "__main__":
+    import bot
+    bot.run()
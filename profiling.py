@@ -0,0 +1,118 @@
+import gc
+import threading
+import tracemalloc
+from collections import Counter
+from config import MEMORY_PROFILING, MEMORY_TRACE_FRAMES
+
+# Telegram rejects messages over 4096 characters
+MAX_REPORT_CHARS = 4000
+
+def rss_bytes():
+    """Resident set size of this process, or None where /proc isn't available"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+class MemoryProfiler:
+    """Opt-in tracemalloc snapshots with diffs between reports, plus sizes of the bot's own containers"""
+
+    def __init__(self, frames=MEMORY_TRACE_FRAMES):
+        self.frames = frames
+        self.counters = {}  # name -> callable returning an entry count
+        self.started = None   # snapshot from when tracing started
+        self.baselines = {}   # consumer -> snapshot from its previous report
+        self.lock = threading.Lock()
+
+    def register(self, name, count):
+        self.counters[name] = count
+
+    def tracing(self):
+        return tracemalloc.is_tracing()
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+        snapshot = self._snapshot()
+        with self.lock:
+            self.started = snapshot
+            self.baselines.clear()
+
+    def stop(self):
+        tracemalloc.stop()
+        with self.lock:
+            self.started = None
+            self.baselines.clear()
+
+    def _snapshot(self):
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        ))
+
+    def object_counts(self):
+        counts = {}
+        for name, count in self.counters.items():
+            try:
+                counts[name] = count()
+            except Exception as e:
+                counts[name] = f"error: {e}"
+        return counts
+
+    def report(self, limit=10, consumer=None, detailed=True):
+        """Memory report; detailed adds gc type counts and, while tracing, top allocations and growth"""
+        # Growth is since the consumer's previous report (its baseline then moves), or since tracing started
+        report = {"tracing": self.tracing(), "rss_bytes": rss_bytes(), "objects": self.object_counts()}
+        if not detailed:
+            return report
+        types = Counter(type(obj).__name__ for obj in gc.get_objects())
+        report["gc_types"] = dict(types.most_common(limit))
+        if not report["tracing"]:
+            return report
+
+        current = self._snapshot()
+        traced, peak = tracemalloc.get_traced_memory()
+        report["traced_bytes"] = traced
+        report["traced_peak_bytes"] = peak
+        report["top"] = [str(stat) for stat in current.statistics("lineno")[:limit]]
+        with self.lock:
+            if consumer is None:
+                previous = self.started
+            else:
+                previous = self.baselines.get(consumer, self.started)
+                self.baselines[consumer] = current
+        if previous is not None:
+            report["growth"] = [str(stat) for stat in current.compare_to(previous, "lineno")[:limit] if stat.size_diff]
+        return report
+
+def format_report(report):
+    """Plain-text rendering of a report for a Telegram message"""
+    def mb(value):
+        return f"{value / 1048576:.1f} MB" if value is not None else "n/a"
+
+    lines = [f"RSS: {mb(report['rss_bytes'])}  tracing: {'on' if report['tracing'] else 'off'}"]
+    if report["tracing"]:
+        lines.append(f"Traced: {mb(report['traced_bytes'])}  peak: {mb(report['traced_peak_bytes'])}")
+    lines.append("")
+    lines.append("Objects:")
+    lines += [f"  {name}: {count}" for name, count in report["objects"].items()]
+    if report.get("gc_types"):
+        lines.append("GC types:")
+        lines += [f"  {name}: {count}" for name, count in report["gc_types"].items()]
+    if report.get("growth"):
+        lines.append("Growth since last report:")
+        lines += [f"  {stat}" for stat in report["growth"]]
+    if report.get("top"):
+        lines.append("Top allocations:")
+        lines += [f"  {stat}" for stat in report["top"]]
+    text = "\n".join(lines)
+    return text if len(text) <= MAX_REPORT_CHARS else text[:MAX_REPORT_CHARS - 3] + "..."
+
+memory_profiler = MemoryProfiler()
+if MEMORY_PROFILING:
+    memory_profiler.start()
@@ -0,0 +1,121 @@
+"""Local stand-in for the Redis commands the shared state backend uses, with a self-check of RedisBackend.
+
+    python redis_standin.py [port]    serve until interrupted (point REDIS_URL at it)
+    python redis_standin.py --check   run RedisBackend against a stand-in on a free port
+"""
+import socketserver
+import sys
+import threading
+import time
+
+class StandInHandler(socketserver.StreamRequestHandler):
+    """Speaks RESP for AUTH, SELECT, PING, GET, SET [NX] [PX ms] and DEL"""
+
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line.startswith(b"*"):
+            return None
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def _reply(self, args):
+        store = self.server.store
+        name = args[0].upper()
+        now = time.time()
+        for key in [k for k, (_, expires_at) in store.items() if expires_at and expires_at <= now]:
+            del store[key]
+        if name in (b"AUTH", b"SELECT"):
+            return b"+OK\r\n"
+        if name == b"PING":
+            return b"+PONG\r\n"
+        if name == b"GET":
+            entry = store.get(args[1])
+            return b"$-1\r\n" if entry is None else b"$%d\r\n%s\r\n" % (len(entry[0]), entry[0])
+        if name == b"DEL":
+            return b":%d\r\n" % sum(store.pop(key, None) is not None for key in args[1:])
+        if name == b"SET":
+            options = [a.upper() for a in args[3:]]
+            expires_at = None
+            if b"PX" in options:
+                expires_at = now + int(args[3 + options.index(b"PX") + 1]) / 1000
+            if b"NX" in options and args[1] in store:
+                return b"$-1\r\n"
+            store[args[1]] = (args[2], expires_at)
+            return b"+OK\r\n"
+        return b"-ERR unknown command '%s'\r\n" % name
+
+    def handle(self):
+        while True:
+            args = self._read_command()
+            if not args:
+                return
+            with self.server.lock:
+                reply = self._reply(args)
+            self.wfile.write(reply)
+
+class StandInServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port=0):
+        super().__init__(("127.0.0.1", port), StandInHandler)
+        self.store = {}  # key -> (value, expires_at or None)
+        self.lock = threading.Lock()
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+def check():
+    """Exercise RedisBackend and SessionStore against a fresh stand-in; exits non-zero on failure"""
+    from state import RedisBackend, SessionStore
+
+    server = StandInServer().start()
+    backend = RedisBackend(f"redis://:secret@127.0.0.1:{server.server_address[1]}/1")
+    failures = []
+
+    def expect(label, actual, expected):
+        print(f"{'ok  ' if actual == expected else 'FAIL'} {label}: {actual!r}")
+        if actual != expected:
+            failures.append(label)
+
+    expect("ping", backend.ping(), True)
+    backend.set("k", {"a": 1})
+    expect("get after set", backend.get("k"), {"a": 1})
+    backend.delete("k")
+    expect("get after delete", backend.get("k"), None)
+    backend.set("short", 1, ttl=0.05)
+    time.sleep(0.1)
+    expect("ttl expiry", backend.get("short"), None)
+
+    token = backend.acquire_lock("refresh", ttl=5)
+    expect("lock acquired", bool(token), True)
+    expect("lock is exclusive", backend.acquire_lock("refresh", ttl=5), None)
+    backend.release_lock("refresh", "not-the-owner")
+    expect("foreign release ignored", backend.acquire_lock("refresh", ttl=5), None)
+    backend.release_lock("refresh", token)
+    expect("lock free after release", bool(backend.acquire_lock("refresh", ttl=5)), True)
+
+    sessions = SessionStore(backend)
+    sessions[42] = {"command": "w"}
+    session = sessions[42]
+    session["anime_name"] = "Naruto"
+    expect("session copy until saved", sessions[42], {"command": "w"})
+    sessions[42] = session
+    expect("session saved", sessions[42]["anime_name"], "Naruto")
+    del sessions[42]
+    expect("session deleted", 42 in sessions, False)
+
+    server.shutdown()
+    print("all checks passed" if not failures else f"{len(failures)} check(s) failed")
+    return not failures
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["--check"]:
+        sys.exit(0 if check() else 1)
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 6379
+    print(f"Redis stand-in listening on 127.0.0.1:{port}")
+    StandInServer(port).serve_forever()
@@ -0,0 +1,298 @@
+import threading
+import time
+from collections import deque
+from contextvars import copy_context
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, FIRST_COMPLETED, wait
+from config import HEDGE_ENABLED, HEDGE_MIN_SAMPLES, HEDGE_MIN_DELAY_MS, LATENCY_WINDOW
+
+# Values a source may return that mean "I don't know this field"
+EMPTY_VALUES = (None, "", "N/A", [], ())
+
+def is_empty(value):
+    return any(value is empty or value == empty for empty in EMPTY_VALUES)
+
+# Primary calls that may be hedged, and the hedges racing them
+hedge_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="source-hedge")
+
+def submit(func, *args):
+    """Run func on the hedge pool with the caller's context, so a background refresh stays one there too"""
+    return hedge_executor.submit(copy_context().run, func, *args)
+
+class LatencyTracker:
+    """Rolling window of call latencies per source"""
+
+    def __init__(self, window=LATENCY_WINDOW, min_samples=HEDGE_MIN_SAMPLES):
+        self.window = window
+        self.min_samples = min_samples
+        self.samples = {}
+        self.hedges = {}
+        self.lock = threading.Lock()
+
+    def record(self, name, ms):
+        with self.lock:
+            self.samples.setdefault(name, deque(maxlen=self.window)).append(ms)
+
+    def record_hedge(self, name, outcome):
+        with self.lock:
+            counts = self.hedges.setdefault(name, {"fired": 0, "won": 0})
+            counts["fired"] += 1
+            if outcome == "won":
+                counts["won"] += 1
+
+    def dump(self):
+        with self.lock:
+            return {name: list(samples) for name, samples in self.samples.items()}
+
+    def restore(self, samples):
+        with self.lock:
+            for name, values in samples.items():
+                self.samples[name] = deque(values, maxlen=self.window)
+
+    def percentile(self, name, pct):
+        """Latency in ms at the given percentile, or None until enough samples exist"""
+        with self.lock:
+            samples = sorted(self.samples.get(name, ()))
+        if len(samples) < self.min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+    def stats(self):
+        names = list(self.samples)
+        return {
+            name: {
+                "samples": len(self.samples[name]),
+                "p50_ms": self.percentile(name, 50),
+                "p95_ms": self.percentile(name, 95),
+                "hedges": self.hedges.get(name, {"fired": 0, "won": 0}),
+            }
+            for name in names
+        }
+
+class Source:
+    """An upstream that can fill some post fields once the inputs it requires are known"""
+
+    def __init__(self, name, fetch, provides, requires=()):
+        self.name = name
+        self.fetch = fetch
+        self.provides = set(provides)
+        self.requires = tuple(requires)
+
+class FieldResolver:
+    """Query sources in declaration order, stopping once every field is settled by its best available source"""
+
+    def __init__(self, sources, field_priorities, accept=None, hedges=None, latency=None):
+        self.sources = list(sources)
+        self.by_name = {source.name: source for source in self.sources}
+        self.priorities = field_priorities
+        self.accept = accept or {}
+        self.hedges = {}  # source name -> alternate source that can supply the same fields
+        needed = {key for source in self.sources for key in source.requires}
+        for name, alternate in (hedges or {}).items():
+            # An abandoned primary counts as answered, so one that supplies other sources' inputs must never be raced
+            if self.by_name[name].provides & needed:
+                print(f"Not hedging {name}: other sources depend on its output")
+                continue
+            self.hedges[name] = alternate
+        self.latency = latency or LatencyTracker()
+
+    def resolve(self, ctx):
+        """Return ({field: value or None}, [sources queried]) for the given lookup context"""
+        state = {"answers": {}, "accepted": {}, "order": [], "ctx": ctx}
+        deadline = ctx.get("deadline")
+        while not (deadline and deadline.expired()):
+            pending = [f for f in self.priorities if not self._settled(f, state, ctx)]
+            if not pending:
+                break
+            source = self._next_source(pending, state, ctx)
+            if source is None:
+                break
+            self._run(source, state, ctx)
+        return {f: self._value(f, state) for f in self.priorities}, state["order"]
+
+    def _call(self, source, ctx):
+        start = time.perf_counter()
+        try:
+            result = source.fetch(ctx) or {}
+        except Exception as e:
+            print(f"Source {source.name} failed: {e}")
+            result = {}
+        ms = round((time.perf_counter() - start) * 1000)
+        self.latency.record(source.name, ms)
+        return result, ms
+
+    def _call_chain(self, names, ctx):
+        """Run an alternate and its prerequisites in order against a private copy of ctx"""
+        results = []
+        for name in names:
+            source = self.by_name[name]
+            result, ms = self._call(source, ctx)
+            results.append((source, result, ms))
+            self._export(source, result, ctx)
+        return results
+
+    def _export(self, source, result, ctx):
+        # Identifiers a source finds become inputs for the sources that depend on it
+        for key in source.provides:
+            if key not in self.priorities and not is_empty(result.get(key)):
+                ctx[key] = result[key]
+
+    def _record(self, source, result, ms, state, ctx):
+        state["answers"][source.name] = result
+        state["order"].append((source.name, ms))
+        self._export(source, result, ctx)
+
+    def _chain(self, name, state, ctx, seen=()):
+        """Sources to run, in order, so that name can run now; None if it can't"""
+        if not self._viable(name, state, ctx, seen):
+            return None
+        steps = []
+        for key in self.by_name[name].requires:
+            if key in ctx or any(key in self.by_name[s].provides for s in steps):
+                continue
+            for provider in self.sources:
+                if key in provider.provides:
+                    sub = self._chain(provider.name, state, ctx, seen + (name,))
+                    if sub is not None:
+                        steps += [s for s in sub if s not in steps]
+                        break
+            else:
+                return None
+        return steps + [name]
+
+    def _stake(self, source, state, ctx):
+        """Unsettled fields this source is being run for"""
+        return [f for f in self.priorities if source.name in self.priorities[f] and not self._settled(f, state, ctx)]
+
+    def _covers(self, alternate, fields, state):
+        """Whether the alternate's answer gives an acceptable value for every one of fields"""
+        return alternate in state["answers"] and all(self._accepted(f, alternate, state) is not None for f in fields)
+
+    def _wait(self, source, future, state, ctx):
+        """Record the call's answer, or abandon it once the deadline passes"""
+        deadline = ctx.get("deadline")
+        try:
+            self._record(source, *future.result(timeout=deadline.remaining() if deadline else None), state, ctx)
+        except TimeoutError:
+            self._abandon(source, future, state, "deadline")
+
+    def _run(self, source, state, ctx):
+        delay = self.latency.percentile(source.name, 95) if HEDGE_ENABLED else None
+        alternate = self.hedges.get(source.name) if delay is not None else None
+        # An alternate that already answered is raced as-is; otherwise it (and its prerequisites) must be runnable
+        answered = alternate in state["answers"]
+        chain = alternate and not answered and self._chain(alternate, state, ctx)
+        deadline = ctx.get("deadline")
+        if not (answered or chain) and not deadline:
+            result, ms = self._call(source, ctx)
+            self._record(source, result, ms, state, ctx)
+            return
+        if not (answered or chain):
+            # Socket timeouts bound each read, not the whole call; enforce the budget here too
+            self._wait(source, submit(self._call, source, ctx), state, ctx)
+            return
+
+        # Give the source its usual p95 before racing an alternate against it
+        stake = self._stake(source, state, ctx)
+        primary = submit(self._call, source, ctx)
+        hedge_delay = max(delay, HEDGE_MIN_DELAY_MS) / 1000
+        try:
+            result, ms = primary.result(timeout=deadline.timeout(hedge_delay) if deadline else hedge_delay)
+            self._record(source, result, ms, state, ctx)
+            return
+        except TimeoutError:
+            pass
+        if deadline and deadline.expired():
+            self._abandon(source, primary, state, "deadline")
+            return
+        if chain:
+            print(f"Source {source.name} slower than its p95 ({delay}ms), hedging with {chain}")
+            hedge = submit(self._call_chain, chain, dict(ctx))
+            done, _ = wait([primary, hedge], timeout=deadline.remaining() if deadline else None, return_when=FIRST_COMPLETED)
+            if not done:
+                hedge.cancel()
+                self._abandon(source, primary, state, "deadline")
+                return
+            if primary in done:
+                hedge.cancel()
+                self.latency.record_hedge(source.name, "lost")
+                self._record(source, *primary.result(), state, ctx)
+                return
+            for alt_source, result, ms in hedge.result():
+                self._record(alt_source, result, ms, state, ctx)
+
+        # The alternate only wins if it covers every field the primary was needed for; the rest wait for the primary
+        if self._covers(alternate, stake, state):
+            print(f"Source {source.name} slower than its p95 ({delay}ms), using {alternate}'s answer instead")
+            self.latency.record_hedge(source.name, "won")
+            self._abandon(source, primary, state, "hedged")
+            return
+        self.latency.record_hedge(source.name, "lost")
+        self._wait(source, primary, state, ctx)
+
+    def _abandon(self, source, future, state, reason):
+        """Give up on a running call; its thread finishes on its own and the answer is ignored"""
+        future.cancel()
+        state["answers"][source.name] = {}
+        state["order"].append((source.name, reason))
+
+    def _accepted(self, field, source_name, state):
+        key = (field, source_name)
+        if key not in state["accepted"]:
+            value = state["answers"][source_name].get(field)
+            if not is_empty(value) and field in self.accept:
+                value = self.accept[field](value, state["ctx"])
+            state["accepted"][key] = None if is_empty(value) else value
+        return state["accepted"][key]
+
+    def _viable(self, source_name, state, ctx, seen=()):
+        """Whether a source has not run yet and its inputs are known or still obtainable"""
+        if source_name in state["answers"] or source_name in seen:
+            return False
+        for key in self.by_name[source_name].requires:
+            if key in ctx:
+                continue
+            providers = [s.name for s in self.sources if key in s.provides]
+            if not any(self._viable(p, state, ctx, seen + (source_name,)) for p in providers):
+                return False
+        return True
+
+    def _settled(self, field, state, ctx):
+        for source_name in self.priorities[field]:
+            if source_name in state["answers"]:
+                if self._accepted(field, source_name, state) is not None:
+                    return True
+            elif self._viable(source_name, state, ctx):
+                return False
+        return True
+
+    def _value(self, field, state):
+        for source_name in self.priorities[field]:
+            if source_name in state["answers"]:
+                value = self._accepted(field, source_name, state)
+                if value is not None:
+                    return value
+        return None
+
+    def _runnable(self, source_name, state, ctx):
+        """The source to run so that source_name can eventually run: itself or a provider of its inputs"""
+        for key in self.by_name[source_name].requires:
+            if key not in ctx:
+                for provider in self.sources:
+                    if key in provider.provides and self._viable(provider.name, state, ctx):
+                        return self._runnable(provider.name, state, ctx)
+                return None
+        return source_name
+
+    def _next_source(self, pending, state, ctx):
+        wanted = set()
+        for field in pending:
+            best = next((s for s in self.priorities[field] if self._viable(s, state, ctx)), None)
+            runnable = best and self._runnable(best, state, ctx)
+            if runnable:
+                wanted.add(runnable)
+        # Every wanted source is the best remaining one for some field, so run the fastest first
+        candidates = [source for source in self.sources if source.name in wanted]
+        if not candidates:
+            return None
+        order = {source.name: i for i, source in enumerate(self.sources)}
+        return min(candidates, key=lambda s: (self.latency.percentile(s.name, 50) or 0, order[s.name]))
@@ -0,0 +1,86 @@
+import asyncio
+import atexit
+import heapq
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from difflib import SequenceMatcher
+from config import SCORING_PROCESSES, SCORING_THRESHOLD
+
+# Title list preloaded into each worker process once per catalog version
+_worker_titles = []
+
+def _init_worker(titles):
+    global _worker_titles
+    _worker_titles = titles
+
+def score_titles(input_name, titles, limit=5, start=0, end=None, cutoff=0.4):
+    """Return the best (score, index, title) matches for input_name in titles[start:end]"""
+    query = input_name.lower()
+    matcher = SequenceMatcher(None)
+    matcher.set_seq1(query)
+    end = len(titles) if end is None else end
+    scored = []
+    for index in range(start, end):
+        title = titles[index]
+        matcher.set_seq2(title.lower())
+        score = matcher.ratio()
+        if score > cutoff:
+            scored.append((score, index, title))
+    return heapq.nlargest(limit, scored, key=lambda x: (x[0], -x[1]))
+
+def _score_shard(input_name, start, end, limit):
+    return score_titles(input_name, _worker_titles, limit, start, end)
+
+def top_matches(input_name, titles, limit=5):
+    """Score the whole title list inline and return the best titles"""
+    return [title for _, _, title in score_titles(input_name, titles, limit)]
+
+class SuggestionScorer:
+    """Fuzzy suggestion scoring that shards large catalogs across a process pool"""
+
+    def __init__(self, processes=SCORING_PROCESSES, threshold=SCORING_THRESHOLD):
+        self.processes = max(1, processes)
+        self.threshold = threshold
+        self.pool = None
+        self.fingerprint = None
+
+    def _pool_for(self, titles):
+        fingerprint = (len(titles), hash(tuple(titles)))
+        if self.pool is None or fingerprint != self.fingerprint:
+            self.shutdown()
+            self.pool = ProcessPoolExecutor(
+                max_workers=self.processes,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(list(titles),)
+            )
+            self.fingerprint = fingerprint
+        return self.pool
+
+    async def suggest(self, input_name, titles, limit=5):
+        """Closest titles for input_name, scored off the event loop for large catalogs"""
+        if len(titles) < self.threshold:
+            return top_matches(input_name, titles, limit)
+        try:
+            loop = asyncio.get_running_loop()
+            pool = self._pool_for(titles)
+            shard = -(-len(titles) // self.processes)
+            shards = await asyncio.gather(*[
+                loop.run_in_executor(pool, _score_shard, input_name, start, min(start + shard, len(titles)), limit)
+                for start in range(0, len(titles), shard)
+            ])
+            merged = heapq.nlargest(limit, [m for part in shards for m in part], key=lambda x: (x[0], -x[1]))
+            return [title for _, _, title in merged]
+        except Exception as e:
+            print(f"Process pool scoring failed, scoring inline: {e}")
+            self.shutdown()
+            return await asyncio.to_thread(top_matches, input_name, titles, limit)
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+            self.fingerprint = None
+
+suggestion_scorer = SuggestionScorer()
+atexit.register(suggestion_scorer.shutdown)
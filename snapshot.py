@@ -0,0 +1,84 @@
+import mmap
+import os
+import pickle
+import threading
+import time
+import zlib
+from config import SNAPSHOT_PATH, SNAPSHOT_INTERVAL, SNAPSHOT_COMPRESS
+
+# File layout: magic, one flags byte, then a pickle (zlib-compressed when flag bit 0 is set)
+SNAPSHOT_MAGIC = b"ANIFLIXSNAP1"
+FLAG_COMPRESSED = 1
+
+_components = {}  # name -> (dump, restore)
+_save_lock = threading.Lock()
+
+def register(name, dump, restore):
+    """Include a piece of in-memory state in snapshots; dump() must return picklable data"""
+    _components[name] = (dump, restore)
+
+def save_snapshot(path=SNAPSHOT_PATH):
+    """Serialize every registered component to path atomically"""
+    start = time.perf_counter()
+    state = {}
+    for name, (dump, _) in list(_components.items()):
+        try:
+            state[name] = dump()
+        except Exception as e:
+            print(f"Snapshot of {name} failed: {e}")
+    payload = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+    flags = 0
+    if SNAPSHOT_COMPRESS:
+        payload = zlib.compress(payload, 1)
+        flags |= FLAG_COMPRESSED
+    with _save_lock:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path + ".tmp", "wb") as f:
+            f.write(SNAPSHOT_MAGIC + bytes([flags]))
+            f.write(payload)
+        os.replace(path + ".tmp", path)
+    print(f"Saved warm-state snapshot ({len(payload):,} bytes, {(time.perf_counter() - start) * 1000:.0f}ms)")
+
+def load_snapshot(path=SNAPSHOT_PATH):
+    """Restore registered components from path; returns True when a snapshot was applied"""
+    start = time.perf_counter()
+    try:
+        with open(path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if mm[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+                    print("Ignoring snapshot with unknown format")
+                    return False
+                flags = mm[len(SNAPSHOT_MAGIC)]
+                with memoryview(mm) as view:
+                    body = view[len(SNAPSHOT_MAGIC) + 1:]
+                    try:
+                        if flags & FLAG_COMPRESSED:
+                            state = pickle.loads(zlib.decompress(body))
+                        else:
+                            state = pickle.loads(body)
+                    finally:
+                        body.release()
+    except (OSError, ValueError) as e:
+        print(f"No warm-state snapshot loaded: {e}")
+        return False
+    except Exception as e:
+        print(f"Corrupt warm-state snapshot ignored: {e}")
+        return False
+    
+    for name, data in state.items():
+        if name in _components:
+            try:
+                _components[name][1](data)
+            except Exception as e:
+                print(f"Restoring {name} from snapshot failed: {e}")
+    print(f"Restored warm state ({', '.join(state)}) in {(time.perf_counter() - start) * 1000:.0f}ms")
+    return True
+
+def snapshot_loop(path=SNAPSHOT_PATH, interval=SNAPSHOT_INTERVAL):
+    """Save a snapshot every interval seconds"""
+    while True:
+        time.sleep(interval)
+        try:
+            save_snapshot(path)
+        except Exception as e:
+            print(f"Periodic snapshot failed: {e}")
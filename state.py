@@ -0,0 +1,279 @@
+import asyncio
+import functools
+import pickle
+import queue
+import socket
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, unquote
+from config import STATE_BACKEND, REDIS_URL, STATE_KEY_PREFIX, SESSION_TTL
+
+class StateBackend(ABC):
+    """Key/value store with expiry and named locks, shared by everything that must survive across replicas"""
+
+    @abstractmethod
+    def get(self, key):
+        """Stored value, or None when missing or expired"""
+
+    @abstractmethod
+    def set(self, key, value, ttl=None):
+        """Store value, expiring after ttl seconds when given"""
+
+    @abstractmethod
+    def delete(self, key):
+        """Remove key if present"""
+
+    @abstractmethod
+    def acquire_lock(self, name, ttl):
+        """Token if the lock was free, else None; the lock frees itself after ttl seconds"""
+
+    @abstractmethod
+    def release_lock(self, name, token):
+        """Free the lock if token still holds it"""
+
+    def ping(self):
+        """Whether the backend is reachable"""
+        return True
+
+class InProcessBackend(StateBackend):
+    """State kept in this process only; values are stored as-is, not copied"""
+
+    def __init__(self):
+        self.entries = {}  # key -> (value, expires_at wall time or None)
+        self.lock = threading.Lock()
+
+    def _live(self, key, now):
+        entry = self.entries.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= now:
+            del self.entries[key]
+            return None
+        return entry
+
+    def get(self, key):
+        with self.lock:
+            entry = self._live(key, time.time())
+        return entry[0] if entry else None
+
+    def set(self, key, value, ttl=None):
+        with self.lock:
+            self.entries[key] = (value, time.time() + ttl if ttl else None)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def acquire_lock(self, name, ttl):
+        token = uuid.uuid4().hex
+        key = f"lock:{name}"
+        with self.lock:
+            if self._live(key, time.time()):
+                return None
+            self.entries[key] = (token, time.time() + ttl)
+        return token
+
+    def release_lock(self, name, token):
+        key = f"lock:{name}"
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] == token:
+                del self.entries[key]
+
+    def count(self, prefix):
+        with self.lock:
+            return sum(1 for key in self.entries if key.startswith(prefix))
+
+    def dump(self):
+        """Unexpired non-lock entries with wall-clock expiries, for warm-state snapshots"""
+        now = time.time()
+        with self.lock:
+            entries = [(key, entry) for key, entry in self.entries.items()
+                       if not key.startswith("lock:") and (entry[1] is None or entry[1] > now)]
+        # Sessions keep changing on the event loop while the snapshot is pickled
+        return {key: (dict(value) if isinstance(value, dict) else value, expires_at) for key, (value, expires_at) in entries}
+
+    def restore(self, entries):
+        with self.lock:
+            self.entries.update(entries)
+
+class RedisError(Exception):
+    pass
+
+class RedisBackend(StateBackend):
+    """Minimal RESP client for Redis or anything that speaks its protocol (GET/SET/DEL)"""
+
+    def __init__(self, url=REDIS_URL, prefix=STATE_KEY_PREFIX, timeout=2.0, pool_size=8):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.db = int(parsed.path.strip("/") or 0)
+        self.prefix = prefix
+        self.timeout = timeout
+        self.pool = queue.LifoQueue(maxsize=pool_size)
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn = (sock, sock.makefile("rb"))
+        if self.password:
+            self._send(conn, "AUTH", self.password)
+        if self.db:
+            self._send(conn, "SELECT", self.db)
+        return conn
+
+    @staticmethod
+    def _encode(args):
+        out = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            if isinstance(arg, str):
+                arg = arg.encode()
+            elif isinstance(arg, int):
+                arg = str(arg).encode()
+            out.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        return b"".join(out)
+
+    def _read_reply(self, reader):
+        line = reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("Connection closed by state server")
+        kind, body = line[:1], line[1:-2]
+        if kind == b"+":
+            return body.decode()
+        if kind == b"-":
+            raise RedisError(body.decode())
+        if kind == b":":
+            return int(body)
+        if kind == b"$":
+            length = int(body)
+            if length < 0:
+                return None
+            data = reader.read(length + 2)
+            if len(data) != length + 2:
+                raise ConnectionError("Connection closed by state server")
+            return data[:-2]
+        if kind == b"*":
+            count = int(body)
+            return None if count < 0 else [self._read_reply(reader) for _ in range(count)]
+        raise RedisError(f"Unexpected reply: {line!r}")
+
+    def _send(self, conn, *args):
+        conn[0].sendall(self._encode(args))
+        return self._read_reply(conn[1])
+
+    def command(self, *args):
+        try:
+            conn = self.pool.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            reply = self._send(conn, *args)
+        except RedisError:
+            self._release(conn)
+            raise
+        except Exception:
+            conn[1].close()
+            conn[0].close()
+            raise
+        self._release(conn)
+        return reply
+
+    def _release(self, conn):
+        try:
+            self.pool.put_nowait(conn)
+        except queue.Full:
+            conn[1].close()
+            conn[0].close()
+
+    def ping(self):
+        try:
+            return self.command("PING") == "PONG"
+        except Exception as e:
+            print(f"State backend ping failed: {e}")
+            return False
+
+    def get(self, key):
+        data = self.command("GET", self.prefix + key)
+        return pickle.loads(data) if data is not None else None
+
+    def set(self, key, value, ttl=None):
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if ttl:
+            self.command("SET", self.prefix + key, data, "PX", max(1, int(ttl * 1000)))
+        else:
+            self.command("SET", self.prefix + key, data)
+
+    def delete(self, key):
+        self.command("DEL", self.prefix + key)
+
+    def acquire_lock(self, name, ttl):
+        token = uuid.uuid4().hex
+        reply = self.command("SET", f"{self.prefix}lock:{name}", token, "NX", "PX", max(1, int(ttl * 1000)))
+        return token if reply == "OK" else None
+
+    def release_lock(self, name, token):
+        # Check-then-delete isn't atomic; losing that race only lets a second refresh start early
+        key = f"{self.prefix}lock:{name}"
+        if self.command("GET", key) == token.encode():
+            self.command("DEL", key)
+
+class SessionStore:
+    """Per-user conversation state; assign a session back after changing it so shared backends see the change"""
+
+    def __init__(self, backend, ttl=SESSION_TTL):
+        self.backend = backend
+        self.ttl = ttl
+
+    def get(self, user_id, default=None):
+        data = self.backend.get(f"session:{user_id}")
+        return default if data is None else data
+
+    def __contains__(self, user_id):
+        return self.get(user_id) is not None
+
+    def set(self, user_id, data):
+        self[user_id] = data
+
+    def discard(self, user_id):
+        """Remove the session; returns whether there was one"""
+        if user_id not in self:
+            return False
+        del self[user_id]
+        return True
+
+    def __getitem__(self, user_id):
+        data = self.get(user_id)
+        if data is None:
+            raise KeyError(user_id)
+        return data
+
+    def __setitem__(self, user_id, data):
+        self.backend.set(f"session:{user_id}", data, self.ttl)
+
+    def __delitem__(self, user_id):
+        self.backend.delete(f"session:{user_id}")
+
+def make_backend(kind=STATE_BACKEND):
+    if kind == "redis":
+        backend = RedisBackend(REDIS_URL)
+        print(f"Using shared state backend at {backend.host}:{backend.port}/{backend.db}")
+        return backend
+    return InProcessBackend()
+
+state_backend = make_backend()
+
+def is_shared():
+    """Whether state is shared with other replicas rather than kept in this process"""
+    return not isinstance(state_backend, InProcessBackend)
+
+# A shared backend does socket I/O; async handlers reach it through these threads instead of blocking the loop
+state_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="state-io")
+
+async def run_state(func, *args):
+    """Run a session or shared-cache access from async code: inline in-process, on the state pool when shared"""
+    if not is_shared():
+        return func(*args)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(state_executor, functools.partial(func, *args))